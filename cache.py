@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Directory of the extracted pdf text cache
+PDF_CACHE_DIR = "./cache/pdf_text"
+
+# Database of the LLM answer cache, least recently used answers are evicted above the limit
+LLM_CACHE_PATH = "./cache/llm_answers.sqlite"
+LLM_CACHE_MAX_ENTRIES = 20000
+# Saves between two evictions, the cache may exceed the limit by this many answers meanwhile
+LLM_CACHE_EVICT_INTERVAL = 100
+
+# Connections of each thread to the sqlite databases (LLM answer cache, crawl state), {path: (process id, connection)},
+# as connections can not be shared between threads or with forked processes
+SQLITE_CONNECTIONS = threading.local()
+# Number of saves in this process, for the eviction interval
+LLM_CACHE_SAVES = 0
+LLM_CACHE_LOCK = threading.Lock()
+
+
+# Get the sha256 hash of a text
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# Get the sha256 hash of a file's content
+def hash_file(file_path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# Write a json file atomically, so concurrent readers never see a partial file
+def write_json_atomic(file_path, data):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, file_path)
+
+
+# Get the cache file path of a pdf
+def pdf_cache_path(file_hash, version):
+    return os.path.join(PDF_CACHE_DIR, f"{file_hash}_{version}.json")
+
+
+# Load the cached pages of a pdf
+# Sample output:
+#       {'num_pages': 3, 'pages': ['page 1 text', 'page 2 text'], 'matches': {'scope': [1]}}
+#       None if the pdf is not cached
+def load_pdf_cache(file_hash, version):
+    try:
+        with open(pdf_cache_path(file_hash, version), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Save the cached pages of a pdf
+def save_pdf_cache(file_hash, version, entry):
+    try:
+        write_json_atomic(pdf_cache_path(file_hash, version), entry)
+    except OSError as e:
+        print(f"Error saving pdf cache: {e}")
+
+
+# Get the connection of this thread to a sqlite database
+# The connection is opened, and set up by setup(connection) (e.g. creating the tables), once per thread and process
+def connect_sqlite(path, setup):
+    connections = getattr(SQLITE_CONNECTIONS, 'connections', None)
+    if connections == None:
+        connections = SQLITE_CONNECTIONS.connections = {}
+    cached = connections.get(path)
+    if cached != None and cached[0] == os.getpid():
+        return cached[1]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    setup(connection)
+    connection.commit()
+    connections[path] = (os.getpid(), connection)
+    return connection
+
+
+# Create the table of the LLM answer cache if not exists
+def setup_llm_cache(connection):
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS llm_answers (
+            cache_key TEXT PRIMARY KEY,
+            answer TEXT NOT NULL,
+            last_used REAL NOT NULL
+        )
+    """)
+    connection.execute("CREATE INDEX IF NOT EXISTS llm_answers_last_used ON llm_answers (last_used)")
+
+
+# Get the connection of this thread to the LLM answer cache
+def connect_llm_cache():
+    return connect_sqlite(LLM_CACHE_PATH, setup_llm_cache)
+
+
+# Get the cache key of a LLM request
+# Sample output:
+#       "chatgpt:gpt-4o-mini:1:9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+def llm_cache_key(provider, model, prompt_version, prompt):
+    return f"{provider}:{model}:{prompt_version}:{hash_text(prompt)}"
+
+
+# Load a cached LLM answer, return None if not cached
+def load_llm_answer(cache_key):
+    try:
+        connection = connect_llm_cache()
+        row = connection.execute("SELECT answer FROM llm_answers WHERE cache_key = ?", (cache_key,)).fetchone()
+        if row == None:
+            return None
+        connection.execute("UPDATE llm_answers SET last_used = ? WHERE cache_key = ?", (time.time(), cache_key))
+        connection.commit()
+        return row[0]
+    except sqlite3.Error as e:
+        print(f"Error loading LLM cache: {e}")
+        return None
+
+
+# Save a LLM answer
+# Every LLM_CACHE_EVICT_INTERVAL saves, the least recently used answers above LLM_CACHE_MAX_ENTRIES are evicted
+def save_llm_answer(cache_key, answer):
+    global LLM_CACHE_SAVES
+    with LLM_CACHE_LOCK:
+        LLM_CACHE_SAVES += 1
+        evict = LLM_CACHE_SAVES % LLM_CACHE_EVICT_INTERVAL == 0
+    try:
+        connection = connect_llm_cache()
+        connection.execute(
+            "INSERT OR REPLACE INTO llm_answers (cache_key, answer, last_used) VALUES (?, ?, ?)",
+            (cache_key, answer, time.time())
+        )
+        if evict:
+            # Uses the last_used index instead of sorting the whole table
+            connection.execute("""
+                DELETE FROM llm_answers WHERE cache_key IN (
+                    SELECT cache_key FROM llm_answers ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (LLM_CACHE_MAX_ENTRIES,))
+        connection.commit()
+    except sqlite3.Error as e:
+        print(f"Error saving LLM cache: {e}")
@@ -0,0 +1,136 @@
+import os
+import re
+import math
+import datetime
+import threading
+import urllib.parse
+
+# Logs of previous crawls, the "Valid PDF downloaded" and "does not contain 'scope 1' or 'scope 2'" lines
+# are the examples the feature weights are learned from
+RANKING_LOG_DIR = "./logs"
+# Features seen in fewer examples are ignored
+RANKING_MIN_COUNT = 10
+# Score lost per position in the original order (Bing rank / page order), breaks ties between similar links
+RANKING_POSITION_WEIGHT = 0.1
+# Candidates smaller than this (bytes, from a HEAD request) are rarely full reports
+RANKING_MIN_PDF_SIZE = 100 * 1024
+RANKING_SIZE_PENALTY = 3
+# Words of company names that say nothing about the company's domain
+COMPANY_STOP_WORDS = {
+    'inc', 'plc', 'corp', 'corporation', 'company', 'group', 'holdings', 'holding', 'ltd', 'limited', 'co',
+    'sa', 'ag', 'nv', 'se', 'spa', 'asa', 'ab', 'class', 'the', 'and', 'of', 'international', 'reg'
+}
+
+LOG_LINE_PATTERN = re.compile(
+    r"^\[(\d{4})-\d\d-\d\d [\d:]+\] (.+?): "
+    r"(Valid PDF downloaded|PDF content does not contain 'scope 1' or 'scope 2') \| URL: (\S+)"
+)
+TOKEN_PATTERN = re.compile(r"[a-z]+|\d+")
+
+# Learned feature weights, loaded on first use
+FEATURE_WEIGHTS = None
+FEATURE_WEIGHTS_LOCK = threading.Lock()
+
+
+# Get the words of a company name that may appear in its domain
+# Sample input:
+#       "Moonpig Group plc"
+# Sample output:
+#       {'moonpig'}
+def get_company_tokens(company_name):
+    return {token for token in TOKEN_PATTERN.findall(company_name.lower())
+            if len(token) >= 3 and not token.isdigit() and token not in COMPANY_STOP_WORDS}
+
+
+# Get the features of a candidate: words of the URL and link text, year tokens relative to the current year,
+# and whether the company name is in the host
+# Words of the company name itself are left out, they only say which company the example came from
+# Sample input:
+#       "ACER", "https://www.acer.com/sustainability/2023_Acer_Sustainability_Report.pdf", "Sustainability Report", 2024
+# Sample output:
+#       {'www', 'com', 'sustainability', 'report', 'pdf', '__recent_year__', '__company_host__'}
+def get_features(company_name, url, text, year):
+    parsed = urllib.parse.urlparse(url.lower())
+    host = parsed.netloc
+    company_tokens = get_company_tokens(company_name)
+    features = set()
+    for token in TOKEN_PATTERN.findall(f"{host} {urllib.parse.unquote(parsed.path)} {parsed.query} {(text or '').lower()}"):
+        if token.isdigit():
+            # Only years are kept from numbers, as recent or old
+            if len(token) == 4 and token[:2] in ('19', '20'):
+                features.add('__recent_year__' if year - int(token) <= 1 else '__old_year__')
+        elif len(token) >= 2 and token not in company_tokens:
+            features.add(token)
+    if any(token in host for token in company_tokens):
+        features.add('__company_host__')
+    return features
+
+
+# Learn the log-odds weight of each feature from the crawl logs
+# A positive weight means the feature is more frequent in valid PDFs than in PDFs without scope 1 / scope 2
+# Sample output:
+#       {'sustainability': 1.52, 'esg': 1.21, '__old_year__': -0.83, 'factsheet': -1.9, ...}
+def learn_feature_weights(log_dir=RANKING_LOG_DIR):
+    examples = set()
+    if os.path.isdir(log_dir):
+        for file_name in os.listdir(log_dir):
+            if not file_name.endswith('.txt'):
+                continue
+            with open(os.path.join(log_dir, file_name), 'r', encoding='utf-8', errors='ignore') as f:
+                for line in f:
+                    match = LOG_LINE_PATTERN.match(line)
+                    if match:
+                        year, company_name, verdict, url = match.groups()
+                        examples.add((int(year), company_name, url, verdict == 'Valid PDF downloaded'))
+
+    counts = {} # feature: [valid, invalid]
+    total = [0, 0]
+    for year, company_name, url, valid in examples:
+        total[0 if valid else 1] += 1
+        for feature in get_features(company_name, url, '', year):
+            counts.setdefault(feature, [0, 0])[0 if valid else 1] += 1
+
+    # Log-odds with add-one smoothing
+    weights = {}
+    for feature, (valid, invalid) in counts.items():
+        if valid + invalid >= RANKING_MIN_COUNT:
+            weights[feature] = math.log((valid + 1) / (total[0] + 2)) - math.log((invalid + 1) / (total[1] + 2))
+    return weights
+
+
+# Get the learned feature weights, learned once per process
+def get_feature_weights():
+    global FEATURE_WEIGHTS
+    with FEATURE_WEIGHTS_LOCK:
+        if FEATURE_WEIGHTS == None:
+            FEATURE_WEIGHTS = learn_feature_weights()
+        return FEATURE_WEIGHTS
+
+
+# Score a candidate PDF, higher is more likely the sustainability report
+# head: (size in bytes or None, content type or None) from a HEAD request, or None if unknown
+def score_candidate(company_name, url, text='', head=None):
+    weights = get_feature_weights()
+    year = datetime.date.today().year
+    score = sum(weights.get(feature, 0) for feature in get_features(company_name, url, text, year))
+    if head:
+        size, content_type = head
+        if size != None and size < RANKING_MIN_PDF_SIZE:
+            score -= RANKING_SIZE_PENALTY
+        if content_type and 'html' in content_type.lower():
+            score -= RANKING_SIZE_PENALTY
+    return score
+
+
+# Sort candidates by score, keeping the original order between similar candidates
+# candidates: [(url, link text)], heads: {url: (size, content type)}
+# Sample output:
+#       ["https://www.acer.com/.../2023_Acer_Sustainability_Report.pdf", "https://www.spglobal.com/.../170654890.pdf"]
+def rank_candidates(company_name, candidates, heads=None):
+    heads = heads or {}
+    scored = [
+        (score_candidate(company_name, url, text, heads.get(url)) - RANKING_POSITION_WEIGHT * position, url)
+        for position, (url, text) in enumerate(candidates)
+    ]
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [url for _, url in scored]
@@ -0,0 +1,157 @@
+import json
+import time
+import queue
+import datetime
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the stage timing histogram buckets
+HISTOGRAM_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf')]
+# Seconds the writer thread waits to collect more lines before writing them
+WRITER_FLUSH_INTERVAL = 0.5
+
+
+# Get a percentile of sorted values
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# Statistics and logs of a crawler run
+# Counters and timings are protected by one lock, and log lines are written by a single background thread,
+# to a text log (one line per message) and a JSON lines event log
+class CrawlMetrics:
+    def __init__(self, log_path, events_path=None):
+        self.log_path = log_path
+        self.events_path = events_path
+        self.lock = threading.Lock()
+        self.stats = {
+            'total_companies': 0,
+            'direct_pdf_success': 0,
+            'webpage_pdf_success': 0,
+            'failed_companies': []
+        }
+        self.timings = {} # stage: [seconds]
+        self.lines = queue.Queue()
+        self.writer = threading.Thread(target=self.write_lines, name='crawl-metrics-writer', daemon=True)
+        self.writer.start()
+
+    # Writer thread: open the files once, and write the queued lines in batches until close()
+    def write_lines(self):
+        log_file = open(self.log_path, 'a', encoding='utf-8')
+        events_file = open(self.events_path, 'a', encoding='utf-8') if self.events_path else None
+        try:
+            closed = False
+            while not closed:
+                batch = [self.lines.get()]
+                time.sleep(WRITER_FLUSH_INTERVAL)
+                while not self.lines.empty():
+                    batch.append(self.lines.get_nowait())
+                for line in batch:
+                    if line == None:
+                        closed = True
+                        continue
+                    text, event = line
+                    if text != None:
+                        log_file.write(text)
+                    if event != None and events_file:
+                        events_file.write(json.dumps(event, ensure_ascii=False) + "\n")
+                log_file.flush()
+                if events_file:
+                    events_file.flush()
+        finally:
+            log_file.close()
+            if events_file:
+                events_file.close()
+
+    # Queue an event, with a text log line if log_message is given
+    def emit(self, event, log_message=None, **fields):
+        now = datetime.datetime.now()
+        text = f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] {log_message}\n" if log_message != None else None
+        self.lines.put((text, {'time': now.isoformat(timespec='milliseconds'), 'event': event, **fields}))
+
+    # Write a log line with timestamp
+    def log(self, message):
+        self.emit('log', message, message=message)
+
+    def add_company(self, count=1):
+        with self.lock:
+            self.stats['total_companies'] += count
+
+    # Record the result of a company
+    # result: 'direct' (PDF found in Bing), 'webpage' (PDF found in webpage) or None (failed)
+    def record_result(self, company_name, result):
+        with self.lock:
+            if result == 'direct':
+                self.stats['direct_pdf_success'] += 1
+            elif result == 'webpage':
+                self.stats['webpage_pdf_success'] += 1
+            else:
+                self.stats['failed_companies'].append(company_name)
+        self.emit('company', company=company_name, result=result)
+
+    # Record the time of a stage
+    def record_time(self, stage, seconds):
+        with self.lock:
+            self.timings.setdefault(stage, []).append(seconds)
+        self.emit('stage', stage=stage, seconds=round(seconds, 4))
+
+    # Time the work inside the block as a stage
+    # Sample usage:
+    #       with metrics.time_stage('download'):
+    #           response = session.get(url)
+    @contextmanager
+    def time_stage(self, stage):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_time(stage, time.monotonic() - start_time)
+
+    # Copy of the counters
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'failed_companies': list(self.stats['failed_companies'])}
+
+    # Latency percentiles and histogram of each stage
+    # Sample output:
+    #       {'download': {'count': 120, 'mean': 1.2, 'p50': 0.8, 'p90': 2.4, 'p99': 9.1, 'max': 12.0,
+    #                     'histogram': [3, 10, 25, 40, 30, 8, 3, 1, 0, 0]}}
+    def get_timings(self):
+        with self.lock:
+            timings = {stage: sorted(values) for stage, values in self.timings.items()}
+        summary = {}
+        for stage, values in timings.items():
+            histogram = [0] * len(HISTOGRAM_BUCKETS)
+            for value in values:
+                histogram[next(i for i, bound in enumerate(HISTOGRAM_BUCKETS) if value <= bound)] += 1
+            summary[stage] = {
+                'count': len(values),
+                'mean': sum(values) / len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'max': values[-1],
+                'histogram': histogram
+            }
+        return summary
+
+    # Sample output:
+    #       ["Stage download: 120 calls, mean 1.20s, p50 0.80s, p90 2.40s, p99 9.10s, max 12.00s",
+    #        "    <=0.1s: 3, <=0.25s: 10, ..., >60s: 0"]
+    def summary_lines(self):
+        lines = []
+        for stage, timing in self.get_timings().items():
+            lines.append(f"Stage {stage}: {timing['count']} calls, mean {timing['mean']:.2f}s, p50 {timing['p50']:.2f}s, "
+                         f"p90 {timing['p90']:.2f}s, p99 {timing['p99']:.2f}s, max {timing['max']:.2f}s")
+            lines.append("    " + ", ".join(
+                f"<={bound}s: {count}" if bound != float('inf') else f">{HISTOGRAM_BUCKETS[-2]}s: {count}"
+                for bound, count in zip(HISTOGRAM_BUCKETS, timing['histogram'])
+            ))
+        return lines
+
+    # Write the remaining lines and stop the writer thread
+    def close(self):
+        self.lines.put(None)
+        self.writer.join()
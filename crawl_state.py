@@ -0,0 +1,336 @@
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+
+from cache import connect_sqlite
+
+# Database of the crawl state, so reruns of the crawler skip the work already finished
+CRAWL_STATE_PATH = "./cache/crawl_state.sqlite"
+
+# Candidate outcomes that are final, other outcomes ('pending', 'failed', 'error') are retried on the next pass
+FINAL_OUTCOMES = ('valid', 'invalid', 'rejected', 'not_pdf', 'scanned')
+# Candidates are given up after this many tries
+CANDIDATE_MAX_TRIES = 3
+# Queries whose candidates are all finished are run again after this many days, to find new candidates
+QUERY_RETRY_DAYS = 7
+# Seconds a negative verdict of a URL is trusted, for every company, before the URL is downloaded again
+URL_VERDICT_TTL = {
+    'invalid': 30 * 86400, # PDF without scope 1 / scope 2
+    'rejected': 30 * 86400, # Not a PDF or too large
+    'failed': 86400 # HTTP error status
+}
+# Seconds the parsed results of a search query are reused before searching again
+SEARCH_CACHE_TTL = 7 * 86400
+# Work queue: seconds a worker holds a claimed company, seconds before a failed company is tried again,
+# and attempts before a company is given up
+QUEUE_LEASE = 1800
+QUEUE_RETRY_DELAY = 300
+QUEUE_MAX_ATTEMPTS = 8
+
+
+# Create the tables of the crawl state if not exist
+def setup_crawl_state(connection):
+    # WAL lets the crawler processes of this machine read while one writes
+    # It needs shared memory, so the file must be on a local disk, never shared by several hosts over the network
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS queries (
+            company_name TEXT NOT NULL,
+            query TEXT NOT NULL,
+            status TEXT NOT NULL,
+            found INTEGER NOT NULL,
+            run_at REAL NOT NULL,
+            PRIMARY KEY (company_name, query)
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS candidates (
+            company_name TEXT NOT NULL,
+            url TEXT NOT NULL,
+            query TEXT,
+            outcome TEXT NOT NULL,
+            content_hash TEXT,
+            tries INTEGER NOT NULL DEFAULT 0,
+            tried_at REAL,
+            PRIMARY KEY (company_name, url)
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS urls (
+            url TEXT PRIMARY KEY,
+            verdict TEXT NOT NULL,
+            content_hash TEXT,
+            file_path TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            checked_at REAL NOT NULL
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS searches (
+            query TEXT PRIMARY KEY,
+            results TEXT NOT NULL,
+            searched_at REAL NOT NULL
+        )
+    """)
+    # Work queue shared by all crawler processes of this machine
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS work_queue (
+            company_name TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            lease_until REAL,
+            retry_at REAL NOT NULL DEFAULT 0
+        )
+    """)
+
+
+# Get the connection of this thread to the crawl state
+def connect_crawl_state():
+    return connect_sqlite(CRAWL_STATE_PATH, setup_crawl_state)
+
+
+# Run the block in a transaction on the connection of this thread, committed at the end, rolled back on errors
+@contextmanager
+def transaction():
+    connection = connect_crawl_state()
+    try:
+        yield connection
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+# Run a statement on the crawl state, errors are printed and do not stop the crawler
+def execute(query, params=(), fetch=False):
+    try:
+        with transaction() as connection:
+            rows = connection.execute(query, params).fetchall()
+            return rows if fetch else None
+    except sqlite3.Error as e:
+        print(f"Error accessing crawl state: {e}")
+        return [] if fetch else None
+
+
+# Record a search query (or a scanned webpage) of a company and its candidate URLs
+# urls: the candidate URLs found, or None if the query failed (then it is retried on the next pass)
+def record_query(company_name, query, urls):
+    try:
+        with transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO queries (company_name, query, status, found, run_at) VALUES (?, ?, ?, ?, ?)",
+                (company_name, query, 'failed' if urls == None else 'ok', len(urls or []), time.time())
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO candidates (company_name, url, query, outcome) VALUES (?, ?, ?, 'pending')",
+                [(company_name, url, query) for url in urls or []]
+            )
+    except sqlite3.Error as e:
+        print(f"Error accessing crawl state: {e}")
+
+
+# Record the outcome of trying a candidate URL of a company
+# outcome: 'valid', 'invalid' (no scope 1 / scope 2), 'rejected' (not a PDF / too large), 'not_pdf' (not a PDF URL),
+#          'scanned' (webpage scanned), 'failed' (HTTP error status) or 'error'
+def record_candidate(company_name, url, outcome, content_hash=None):
+    execute("""
+        INSERT INTO candidates (company_name, url, outcome, content_hash, tries, tried_at) VALUES (?, ?, ?, ?, 1, ?)
+        ON CONFLICT (company_name, url) DO UPDATE SET
+            outcome = excluded.outcome,
+            content_hash = COALESCE(excluded.content_hash, candidates.content_hash),
+            tries = candidates.tries + 1,
+            tried_at = excluded.tried_at
+    """, (company_name, url, outcome, content_hash, time.time()))
+
+
+# Check if a query of a company has nothing left to do: it succeeded within QUERY_RETRY_DAYS,
+# and each of its candidates has a final outcome or was given up
+def is_query_done(company_name, query):
+    rows = execute(
+        "SELECT status, run_at FROM queries WHERE company_name = ? AND query = ?", (company_name, query), fetch=True
+    )
+    if not rows or rows[0][0] != 'ok' or rows[0][1] < time.time() - QUERY_RETRY_DAYS * 86400:
+        return False
+    placeholders = ", ".join("?" * len(FINAL_OUTCOMES))
+    pending = execute(f"""
+        SELECT COUNT(*) FROM candidates
+        WHERE company_name = ? AND query = ? AND outcome NOT IN ({placeholders}) AND tries < ?
+    """, (company_name, query, *FINAL_OUTCOMES, CANDIDATE_MAX_TRIES), fetch=True)
+    return bool(pending) and pending[0][0] == 0
+
+
+# Keep the candidate URLs of a company that are new or can be retried, in the same order
+# Sample input:
+#       "APPLE INC", ["https://a.com/report.pdf", "https://b.com/esg.pdf"]
+# Sample output (report.pdf was already found without scope 1 / scope 2):
+#       ["https://b.com/esg.pdf"]
+def filter_pending_urls(company_name, urls):
+    placeholders = ", ".join("?" * len(FINAL_OUTCOMES))
+    finished = {
+        row[0] for row in execute(f"""
+            SELECT url FROM candidates
+            WHERE company_name = ? AND (outcome IN ({placeholders}) OR tries >= ?)
+        """, (company_name, *FINAL_OUTCOMES, CANDIDATE_MAX_TRIES), fetch=True)
+    }
+    return [url for url in urls if url not in finished]
+
+
+# Load the last verdict of a URL, shared by all companies
+# Sample output:
+#       {'verdict': 'valid', 'content_hash': '9f86d0...', 'file_path': './reports/APPLE INC.pdf',
+#        'etag': '"5f2b-1a"', 'last_modified': 'Tue, 02 Apr 2024 08:00:00 GMT', 'checked_at': 1718000000.0}
+#       None if the URL was never checked, or its negative verdict expired
+def load_url_verdict(url):
+    try:
+        with transaction() as connection:
+            row = connection.execute("""
+                SELECT verdict, content_hash, file_path, etag, last_modified, checked_at FROM urls WHERE url = ?
+            """, (url,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Error accessing crawl state: {e}")
+        return None
+    if row == None:
+        return None
+    entry = dict(zip(('verdict', 'content_hash', 'file_path', 'etag', 'last_modified', 'checked_at'), row))
+    if entry['verdict'] in URL_VERDICT_TTL and entry['checked_at'] < time.time() - URL_VERDICT_TTL[entry['verdict']]:
+        return None
+    return entry
+
+
+# Save the verdict of a downloaded URL
+# verdict: 'valid' (with the file path and validators for conditional requests), 'invalid', 'rejected' or 'failed'
+def save_url_verdict(url, verdict, content_hash=None, file_path=None, etag=None, last_modified=None):
+    try:
+        with transaction() as connection:
+            connection.execute("""
+                INSERT OR REPLACE INTO urls (url, verdict, content_hash, file_path, etag, last_modified, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (url, verdict, content_hash, file_path, etag, last_modified, time.time()))
+    except sqlite3.Error as e:
+        print(f"Error accessing crawl state: {e}")
+
+
+# Normalise a search query, so queries differing only in case or spaces share the cached results
+# Sample input:
+#       "APPLE INC  sustainability report 2024 pdf"
+# Sample output:
+#       "apple inc sustainability report 2024 pdf"
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+# Load the cached (href, text) results of a search query, return None if not cached or older than SEARCH_CACHE_TTL
+def load_search_results(query):
+    rows = execute(
+        "SELECT results FROM searches WHERE query = ? AND searched_at >= ?",
+        (normalize_query(query), time.time() - SEARCH_CACHE_TTL), fetch=True
+    )
+    if not rows:
+        return None
+    return [tuple(result) for result in json.loads(rows[0][0])]
+
+
+# Save the (href, text) results of a search query
+def save_search_results(query, results):
+    execute(
+        "INSERT OR REPLACE INTO searches (query, results, searched_at) VALUES (?, ?, ?)",
+        (normalize_query(query), json.dumps(results, ensure_ascii=False), time.time())
+    )
+
+
+# Add companies to the work queue, companies already queued or claimed keep their state
+# Companies marked done are queued again (their PDF is missing), and failed companies too if retry_failed
+def enqueue_companies(company_names, retry_failed=False):
+    reset_status = ('done', 'failed') if retry_failed else ('done',)
+    try:
+        with transaction() as connection:
+            connection.executemany(f"""
+                INSERT INTO work_queue (company_name, status) VALUES (?, 'queued')
+                ON CONFLICT (company_name) DO UPDATE SET status = 'queued', attempts = 0, retry_at = 0
+                WHERE status IN ({", ".join("?" * len(reset_status))})
+            """, [(company_name, *reset_status) for company_name in company_names])
+    except sqlite3.Error as e:
+        print(f"Error accessing crawl state: {e}")
+
+
+# Claim up to count companies for a worker, held for QUEUE_LEASE seconds
+# Never attempted companies come first, then the companies with the most candidates left to retry
+# Companies whose worker died (lease expired) are claimed again
+def claim_companies(worker_id, count):
+    now = time.time()
+    placeholders = ", ".join("?" * len(FINAL_OUTCOMES))
+    try:
+        with transaction() as connection:
+            # Lock the queue, so two workers never claim the same company
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(f"""
+                SELECT company_name FROM work_queue AS w
+                WHERE (status = 'queued' OR (status = 'claimed' AND lease_until < ?)) AND retry_at <= ?
+                ORDER BY attempts, (
+                    SELECT COUNT(*) FROM candidates AS c
+                    WHERE c.company_name = w.company_name AND c.outcome NOT IN ({placeholders}) AND c.tries < ?
+                ) DESC
+                LIMIT ?
+            """, (now, now, *FINAL_OUTCOMES, CANDIDATE_MAX_TRIES, count)).fetchall()
+            company_names = [row[0] for row in rows]
+            connection.executemany(
+                "UPDATE work_queue SET status = 'claimed', claimed_by = ?, lease_until = ? WHERE company_name = ?",
+                [(worker_id, now + QUEUE_LEASE, company_name) for company_name in company_names]
+            )
+            return company_names
+    except sqlite3.Error as e:
+        print(f"Error accessing crawl state: {e}")
+        return []
+
+
+# Check if another attempt of a company could do anything: it has no query yet, a failed query,
+# or a candidate without final outcome that can be tried again
+def has_work_left(connection, company_name):
+    placeholders = ", ".join("?" * len(FINAL_OUTCOMES))
+    queries, failed_queries, pending_candidates = connection.execute(f"""
+        SELECT
+            (SELECT COUNT(*) FROM queries WHERE company_name = ?),
+            (SELECT COUNT(*) FROM queries WHERE company_name = ? AND status != 'ok'),
+            (SELECT COUNT(*) FROM candidates
+             WHERE company_name = ? AND outcome NOT IN ({placeholders}) AND tries < ?)
+    """, (company_name, company_name, company_name, *FINAL_OUTCOMES, CANDIDATE_MAX_TRIES)).fetchone()
+    return queries == 0 or failed_queries > 0 or pending_candidates > 0
+
+
+# Finish the claim of a company: done if a PDF was found, else queued again after QUEUE_RETRY_DELAY
+# A company is failed at once when nothing is left to retry, instead of being claimed again for nothing
+# Return True if the company is finished (found, nothing left to retry, or failed QUEUE_MAX_ATTEMPTS times)
+def complete_company(company_name, found):
+    if found:
+        execute("UPDATE work_queue SET status = 'done', lease_until = NULL WHERE company_name = ?", (company_name,))
+        return True
+    try:
+        with transaction() as connection:
+            give_up = not has_work_left(connection, company_name)
+            connection.execute("""
+                UPDATE work_queue SET
+                    attempts = attempts + 1,
+                    status = CASE WHEN ? OR attempts + 1 >= ? THEN 'failed' ELSE 'queued' END,
+                    lease_until = NULL,
+                    retry_at = ?
+                WHERE company_name = ?
+            """, (give_up, QUEUE_MAX_ATTEMPTS, time.time() + QUEUE_RETRY_DELAY, company_name))
+            row = connection.execute("SELECT status FROM work_queue WHERE company_name = ?", (company_name,)).fetchone()
+            return row != None and row[0] == 'failed'
+    except sqlite3.Error as e:
+        print(f"Error accessing crawl state: {e}")
+        return False
+
+
+# Get the seconds until the next queued company can be claimed
+# Companies claimed by other workers are left to them
+# Sample output:
+#       0 (a company can be claimed now), 120.5, or None (nothing left in the queue)
+def get_queue_wait():
+    rows = execute("SELECT MIN(retry_at) FROM work_queue WHERE status = 'queued'", fetch=True)
+    if not rows or rows[0][0] == None:
+        return None
+    return max(0, rows[0][0] - time.time())
@@ -1,33 +1,302 @@
 import os
 import time
+import uuid
+import shutil
+import random
+import socket
 import datetime
+import queue
+import asyncio
 import urllib.parse
 import threading
-from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from contextlib import contextmanager, nullcontext, ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException, TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-from process_pdf import extract_text_from_pdf
+import crawl_state
+from cache import hash_file
+from candidate_ranking import rank_candidates
+from crawl_metrics import CrawlMetrics
+from process_pdf import has_scope_page
 from database import get_data
 
 # Disable warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# Initialize global variables
-LOG_FILENAME = None
-STATS = None
+# Statistics and logs of the running crawl (crawl_metrics.CrawlMetrics), log messages are printed without it
+METRICS = None
+
+# Maximum size of a downloaded PDF, larger files are abandoned
+MAX_PDF_SIZE = 100 * 1024 * 1024
+# Size of the chunks written to disk while downloading
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Content types accepted for a PDF download (servers often send PDFs as binary data)
+PDF_CONTENT_TYPES = ['pdf', 'octet-stream', 'binary', 'download']
+# Candidate PDFs of a company downloaded at the same time, the first valid one cancels the others
+# (1 downloads the candidates one by one)
+SPECULATIVE_DOWNLOADS = 3
+# Bandwidth (bytes per second) shared by the downloads of one company, None for no limit
+COMPANY_BANDWIDTH_LIMIT = 10 * 1024 * 1024
+
+# HTTP session settings: hosts kept in the pool, keep-alive connections per host,
+# (connect, read) timeout in seconds, and retries on connection errors
+# (429 / 5xx responses are handled by the host scheduler)
+HTTP_POOL_HOSTS = 500
+HTTP_CONNECTIONS_PER_HOST = 4
+HTTP_TIMEOUT = (10, 30)
+HTTP_RETRIES = 2
+HTTP_BACKOFF_FACTOR = 1
+# Maximum bytes of a page read over plain HTTP, the links of longer pages are read from the first bytes only
+MAX_PAGE_SIZE = 5 * 1024 * 1024
+
+# Host scheduler settings: requests in flight per host (1 for hosts slower than HOST_SLOW_LATENCY seconds),
+# and exponential backoff in seconds after 429 / 5xx responses or errors
+HOST_MAX_CONCURRENCY = 4
+HOST_SLOW_LATENCY = 10
+HOST_BACKOFF_BASE = 2
+HOST_BACKOFF_MAX = 300
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Shared HTTP session of the crawler, created on first use
+HTTP_SESSION = None
+HTTP_SESSION_LOCK = threading.Lock()
+
+# Link discovery backend: "http" reads links from the static HTML over the HTTP session, and only
+# uses Selenium when a page has no links (e.g. rendered by JavaScript), "selenium" always uses the browser
+DISCOVERY_MODE = 'http'
+# Bing search page, can be pointed to a local server for testing
+BING_SEARCH_URL = "https://www.bing.com/search"
+# Headers of HTML page requests, same user agent as the WebDriver
+BROWSER_HEADERS = {
+    'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36",
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9'
+}
+# Selenium queries of Bing search results and links on a webpage
+BING_RESULT_QUERY = (By.CSS_SELECTOR, '.b_algo h2 a')
+LINK_QUERY = (By.TAG_NAME, "a")
+# JavaScript returning [href, text] of every element matching a CSS selector, so a page with thousands of
+# links is read in one WebDriver call instead of two calls per link
+HARVEST_LINKS_SCRIPT = """
+return Array.from(document.querySelectorAll(arguments[0]), function (element) {
+    return [element.href || element.getAttribute('href'), element.innerText || element.textContent || ''];
+});
+"""
+
+# Number of WebDrivers shared by the companies in batch processing
+CRAWLER_WORKERS = 5
+# Number of companies a WebDriver processes before it is replaced by a fresh one
+DRIVER_MAX_USES = 50
+# WebDriver pool of the running batch
+DRIVER_POOL = None
+
+# Limits of the async crawl engine: companies in flight, and concurrent work of each stage
+CRAWL_COMPANIES = 200
+CRAWL_SEARCHES = 10
+CRAWL_PAGE_SCANS = 20
+CRAWL_DOWNLOADS = 100
+# Companies claimed from the shared work queue at a time, and seconds between checks for companies due to retry
+QUEUE_CLAIM_SIZE = 20
+QUEUE_POLL_INTERVAL = 5
+# Times a stage is run again after HostBusy, then its thread waits for the host itself
+HOST_BUSY_MAX_RERUNS = 10
+
+# Candidate PDFs are downloaded in score order (see candidate_ranking.py)
+# HEAD requests add the size and content type of the candidates to their score
+RANKING_HEAD_REQUESTS = True
+RANKING_HEAD_WORKERS = 4
 
 # Helper Function: Write log
 def write_log(message):
     """Write log with timestamp"""
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    with open(LOG_FILENAME, 'a', encoding='utf-8') as f:
-        f.write(f"[{timestamp}] {message}\n")
+    metrics = METRICS # METRICS is reset to None when the run ends
+    if metrics == None:
+        print(message)
+        return
+    metrics.log(message)
+
+# Helper Function: Time a stage of the crawl (search, link_scan, download, validation)
+def time_stage(stage):
+    metrics = METRICS
+    if metrics == None:
+        return nullcontext()
+    return metrics.time_stage(stage)
+
+# Helper Function: Get the shared HTTP session, connections are kept alive and reused across threads
+def get_http_session():
+    global HTTP_SESSION
+    with HTTP_SESSION_LOCK:
+        if HTTP_SESSION is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                status=0,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                allowed_methods=['GET', 'HEAD']
+            )
+            # Requests in flight per host are limited by the host scheduler, and response bodies are read after
+            # the host slot is released, so a thread never waits for a pooled connection (pool_block=False):
+            # when all kept connections of a host are reading bodies, an extra one is opened and closed after use
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_HOSTS,
+                pool_maxsize=HTTP_CONNECTIONS_PER_HOST,
+                pool_block=False,
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.verify = False
+            HTTP_SESSION = session
+    return HTTP_SESSION
+
+# Helper Function: Count requests and new connections of the HTTP session
+# Sample output:
+#       {'requests': 120, 'connections': 35, 'reused': 85}
+def get_http_stats():
+    stats = {'requests': 0, 'connections': 0, 'reused': 0}
+    if HTTP_SESSION is None:
+        return stats
+    for adapter in set(HTTP_SESSION.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_connections
+    stats['reused'] = stats['requests'] - stats['connections']
+    return stats
+
+# Raised instead of waiting when a host slot is not free in a thread of the crawl engine
+# The engine waits for the host with wait_async and runs the stage again
+class HostBusy(Exception):
+    def __init__(self, url):
+        super().__init__(f"Host busy: {url}")
+        self.url = url
+
+# Per-host politeness scheduler
+# Tracks requests in flight and latency of every host, and blocks a host after 429 / 5xx responses or errors,
+# for the Retry-After time or an exponential backoff with jitter
+class HostScheduler:
+    def __init__(self, max_concurrency=HOST_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.hosts = {}
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0}
+
+    def get_host(self, url):
+        return urllib.parse.urlparse(url).netloc.lower()
+
+    def get_state(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {'active': 0, 'blocked_until': 0, 'failures': 0, 'latency': None}
+        return self.hosts[host]
+
+    # Requests in flight allowed for the host, only one for slow hosts
+    def get_limit(self, state):
+        return 1 if state['latency'] and state['latency'] > HOST_SLOW_LATENCY else self.max_concurrency
+
+    # Seconds until the host accepts another request, 0 if it accepts one now
+    def get_delay(self, url):
+        with self.lock:
+            state = self.get_state(self.get_host(url))
+            if state['active'] >= self.get_limit(state):
+                return 0.1
+            return max(0, state['blocked_until'] - time.monotonic())
+
+    # Wait without blocking the event loop, so other hosts' work goes on meanwhile
+    async def wait_async(self, url):
+        delay = self.get_delay(url)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.get_delay(url)
+
+    # Take a request slot of the host if one is free now
+    def try_acquire(self, url):
+        with self.lock:
+            state = self.get_state(self.get_host(url))
+            if state['active'] < self.get_limit(state) and state['blocked_until'] <= time.monotonic():
+                state['active'] += 1
+                self.stats['requests'] += 1
+                return True
+            return False
+
+    # Take a request slot of the host, waiting in this thread if the host is busy or blocked
+    # Inside run_in_engine with no_wait, raise HostBusy instead of waiting
+    def acquire(self, url):
+        while not self.try_acquire(url):
+            if getattr(self.local, 'no_wait', False):
+                raise HostBusy(url)
+            time.sleep(max(self.get_delay(url), 0.05))
+
+    # Run a function in a thread of the crawl engine
+    # no_wait: busy or blocked hosts raise HostBusy instead of waiting
+    # progress: dict kept across the runs of the same stage, so retries go on from the trials of earlier runs
+    def run_in_engine(self, progress, no_wait, function, *args):
+        self.local.no_wait = no_wait
+        self.local.progress = progress
+        try:
+            return function(*args)
+        finally:
+            self.local.no_wait = False
+            self.local.progress = None
+
+    # Get the progress dict of the stage running in this thread, a new dict outside the crawl engine
+    def get_progress(self):
+        progress = getattr(self.local, 'progress', None)
+        return {} if progress == None else progress
+
+    # Give back the slot, and update latency and backoff with the outcome of the request
+    def release(self, url, latency, status=None, retry_after=None, error=False):
+        with self.lock:
+            state = self.get_state(self.get_host(url))
+            state['active'] -= 1
+            state['latency'] = latency if state['latency'] is None else 0.8 * state['latency'] + 0.2 * latency
+            if error or status in RETRY_STATUS_CODES:
+                self.stats['throttled' if status == 429 else 'errors'] += 1
+                state['failures'] += 1
+                try:
+                    backoff = float(retry_after)
+                except (TypeError, ValueError):
+                    backoff = HOST_BACKOFF_BASE * 2 ** (state['failures'] - 1) * random.uniform(0.5, 1.5)
+                state['blocked_until'] = time.monotonic() + min(backoff, HOST_BACKOFF_MAX)
+            else:
+                state['failures'] = 0
+
+    # Run one request in a host slot, the caller fills in the status and Retry-After of the response
+    # Sample usage:
+    #       with HOST_SCHEDULER.slot(url) as outcome:
+    #           response = get_http_session().get(url)
+    #           outcome['status'] = response.status_code
+    @contextmanager
+    def slot(self, url):
+        self.acquire(url)
+        start_time = time.monotonic()
+        outcome = {'status': None, 'retry_after': None, 'error': False}
+        try:
+            yield outcome
+        except Exception:
+            outcome['error'] = True
+            raise
+        finally:
+            self.release(url, time.monotonic() - start_time, **outcome)
+
+    # Sample output:
+    #       "Host Requests: 120, Throttled (429): 3, Errors: 5"
+    def summary(self):
+        return f"Host Requests: {self.stats['requests']}, Throttled (429): {self.stats['throttled']}, Errors: {self.stats['errors']}"
+
+HOST_SCHEDULER = HostScheduler()
 
 # Helper Function: Initialize Selenium WebDriver
 def init_driver():
@@ -43,29 +312,197 @@ def init_driver():
     options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36")
     return webdriver.Chrome(options=options)
 
+# Pool of reusable Selenium WebDrivers
+# Drivers are reset (cookies, tabs) between companies, and replaced after max_uses or when broken
+class DriverPool:
+    def __init__(self, size, max_uses=DRIVER_MAX_USES):
+        self.size = size
+        self.max_uses = max_uses
+        self.idle = queue.Queue()
+        self.uses = {}
+        self.lock = threading.Lock()
+        self.alive = 0
+        self.stats = {'created': 0, 'recycled': 0, 'acquired': 0, 'wait_time': 0.0}
+
+    # Start all drivers in parallel, so the first companies do not wait for Chrome to launch
+    # Drivers that fail to start are only printed, the pool starts them again when needed
+    def warm_up(self):
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            futures = [executor.submit(self.create_driver) for _ in range(self.size)]
+        for future in futures:
+            try:
+                driver = future.result()
+            except Exception as e:
+                print(f"Error starting WebDriver: {e}")
+                continue
+            if driver:
+                self.idle.put(driver)
+
+    def create_driver(self):
+        with self.lock:
+            if self.alive >= self.size:
+                return None
+            self.alive += 1
+        try:
+            driver = init_driver()
+        except Exception:
+            with self.lock:
+                self.alive -= 1
+            raise
+        with self.lock:
+            self.uses[id(driver)] = 0
+            self.stats['created'] += 1
+        return driver
+
+    # Get an idle driver, or start a new one if the pool is not full
+    # None in the idle queue means a discarded driver could not be replaced, the waiter then starts one itself,
+    # and fails with the launch error instead of waiting for a driver that will never come
+    def acquire(self):
+        start_time = time.monotonic()
+        driver = None
+        while driver == None:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                driver = self.create_driver() or self.idle.get()
+            if driver == None:
+                driver = self.create_driver()
+        with self.lock:
+            self.stats['acquired'] += 1
+            self.stats['wait_time'] += time.monotonic() - start_time
+        return driver
+
+    # Return a driver to the pool after resetting its state
+    def release(self, driver, broken=False):
+        with self.lock:
+            self.uses[id(driver)] += 1
+            worn_out = self.uses[id(driver)] >= self.max_uses
+        if not broken and not worn_out:
+            try:
+                # Close extra tabs, clear cookies and leave the last page
+                for handle in driver.window_handles[1:]:
+                    driver.switch_to.window(handle)
+                    driver.close()
+                driver.switch_to.window(driver.window_handles[0])
+                driver.delete_all_cookies()
+                driver.get('about:blank')
+                self.idle.put(driver)
+                return
+            except WebDriverException:
+                pass # The driver crashed, replace it
+        self.discard(driver)
+
+    def discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self.lock:
+            del self.uses[id(driver)]
+            self.alive -= 1
+            self.stats['recycled'] += 1
+        # Wake up a waiting thread with a fresh driver, or with None if Chrome fails to start
+        try:
+            new_driver = self.create_driver()
+        except Exception as e:
+            print(f"Error starting WebDriver: {e}")
+            new_driver = None
+        self.idle.put(new_driver)
+
+    @contextmanager
+    def driver(self):
+        driver = self.acquire()
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken)
+
+    # Quit all idle drivers
+    def close(self):
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if driver == None:
+                continue
+            try:
+                driver.quit()
+            except Exception:
+                pass
+            with self.lock:
+                self.alive -= 1
+
+    # Sample output:
+    #       "Drivers Created: 5, Recycled: 1, Average Wait: 0.12s"
+    def summary(self):
+        average_wait = self.stats['wait_time'] / self.stats['acquired'] if self.stats['acquired'] else 0
+        return f"Drivers Created: {self.stats['created']}, Recycled: {self.stats['recycled']}, Average Wait: {average_wait:.2f}s"
+
+# Helper Function: Borrow a WebDriver only when a page needs the browser
+# Yield a function returning the borrowed driver, the driver is returned when the block ends
+@contextmanager
+def lazy_driver():
+    with ExitStack() as stack:
+        drivers = []
+        def get_driver():
+            if not drivers:
+                drivers.append(stack.enter_context(borrow_driver()))
+            return drivers[0]
+        yield get_driver
+
+# Helper Function: Borrow a WebDriver from the batch pool, or start a single one outside batch processing
+@contextmanager
+def borrow_driver():
+    if DRIVER_POOL:
+        with DRIVER_POOL.driver() as driver:
+            yield driver
+    else:
+        driver = init_driver()
+        try:
+            yield driver
+        finally:
+            driver.quit()
+
 # Helper Function: Get search results using selenium
+# The trials are counted in the stage progress, so a rerun of the crawl engine after HostBusy does not start over
 def get_search_results(driver, company_name, search_url, search_query, max_trials=3):
-    for trial in range(max_trials): # Try up to 3 times
+    progress = HOST_SCHEDULER.get_progress()
+    trials_key = ('search_trials', search_url)
+    while progress.get(trials_key, 0) < max_trials: # Try up to 3 times
+        trial = progress.get(trials_key, 0)
         try:
-            # Visit search page
-            driver.get(search_url)
-            wait = WebDriverWait(driver, 30)
-            
-            # Wait for search results to load
-            search_results = wait.until(
-                EC.presence_of_all_elements_located(search_query)
-            )
+            # Visit search page, the host scheduler spaces out retries to the same host
+            with HOST_SCHEDULER.slot(search_url) as outcome:
+                progress[trials_key] = trial + 1
+                driver.get(search_url)
+                wait = WebDriverWait(driver, 30)
+                
+                # Wait for search results to load
+                # No results in time is the answer to the query, not a failure of the host
+                try:
+                    search_results = wait.until(
+                        EC.presence_of_all_elements_located(search_query)
+                    )
+                except TimeoutException:
+                    return None
             
-            # Check if search results are retrieved successfully
-            if search_results:
-                return search_results
-            # If not found, wait 2 seconds and retry
-            time.sleep(2)
+                # Check if search results are retrieved successfully
+                if search_results:
+                    return search_results
+                # If not found, back off the host and retry
+                outcome['error'] = True
 
-        # If there is an error, and not reached max trials, wait 2 seconds and retry
+        # The crawl engine waits for the host and runs the search again
+        except HostBusy:
+            raise
+        # If there is an error, and not reached max trials, retry after the host backoff
         except Exception as e:
             if trial < max_trials - 1:
-                time.sleep(2)
                 continue
             # If reached max trials, write log and return None
             write_log(f"{company_name}: Failed to get search results after {max_trials} attempts: {str(e)}")
@@ -74,254 +511,809 @@ def get_search_results(driver, company_name, search_url, search_query, max_trial
     # If all attempts failed, return None
     return None
 
-# Helper Function: Download PDF file (including verify whether content contains scope 1 or scope 2)
-def download_pdf(company_name, url, max_trials=3):
-    
-    # Check if URL is PDF
-    if 'pdf' not in url:
-        write_log(f"{company_name}: Is not a PDF URL | URL: {url}")
+# Candidate PDFs of a company downloaded at the same time
+# The first valid PDF wins and cancels the other downloads, which share one bandwidth limit
+class DownloadRace:
+    def __init__(self, bandwidth=COMPANY_BANDWIDTH_LIMIT):
+        self.bandwidth = bandwidth
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    # Claim the win for a valid PDF, only the first caller gets True, and the other downloads are cancelled
+    def win(self):
+        with self.lock:
+            if self.cancel_event.is_set():
+                return False
+            self.cancel_event.set()
+            return True
+
+    # Wait until a chunk fits in the bandwidth limit, return False if the download is cancelled meanwhile
+    def throttle(self, size):
+        delay = 0
+        if self.bandwidth:
+            with self.lock:
+                now = time.monotonic()
+                start_time = max(self.next_time, now)
+                self.next_time = start_time + size / self.bandwidth
+                delay = start_time - now
+        if delay > 0:
+            return not self.cancel_event.wait(delay)
+        return not self.cancel_event.is_set()
+
+# Helper Function: Remove a file if it exists
+def remove_file(file_path):
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+# Helper Function: Stream the response body into a file, checking type and size as early as possible
+# Return None if saved, otherwise the reason of rejection
+# With a race, the download stops once another PDF of the company is valid
+def save_pdf_response(response, file_path, race=None):
+
+    # Reject by headers before downloading the body
+    content_type = response.headers.get('Content-Type', '').lower()
+    if content_type and not any(pdf_type in content_type for pdf_type in PDF_CONTENT_TYPES):
+        return f"Content type is not PDF ({content_type})"
+    content_length = int(response.headers.get('Content-Length') or 0)
+    if content_length > MAX_PDF_SIZE:
+        return f"PDF is too large ({content_length} bytes)"
+
+    # Write the body chunk by chunk, so memory stays bounded regardless of the file size
+    size = 0
+    with open(file_path, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if size == 0 and b'%PDF-' not in chunk[:1024]:
+                return "File is not a PDF"
+            size += len(chunk)
+            if size > MAX_PDF_SIZE:
+                return f"PDF is too large (over {MAX_PDF_SIZE} bytes)"
+            if race and not race.throttle(len(chunk)):
+                return "Download cancelled"
+            f.write(chunk)
+    return None
+
+# Returned by download_pdf_attempt when the download should be tried again
+RETRY = 'retry'
+
+# Helper Function: Check if the valid PDF downloaded before from a URL is still on disk and unchanged
+def has_cached_pdf(cached):
+    return cached != None and cached['verdict'] == 'valid' and cached['file_path'] != None and \
+           os.path.exists(cached['file_path']) and hash_file(cached['file_path']) == cached['content_hash']
+
+# Helper Function: Try to download a PDF file once
+# Return the PDF path if valid, None if rejected, or RETRY after a 429 / 5xx response or an error
+# URLs already rejected for any company are skipped, and valid PDFs are only downloaded again if changed
+# With a race, only the first valid PDF of the company is kept
+def download_pdf_attempt(company_name, url, last_trial=False, race=None):
+
+    # Create PDF file path, the file is downloaded to a unique temporary path and only kept if valid
+    pdf_path = f"./reports/{company_name}.pdf"
+    temp_path = f"{pdf_path}.{uuid.uuid4().hex[:8]}.part"
+
+    # Check the last verdict of the URL
+    cached = crawl_state.load_url_verdict(url)
+    if cached and cached['verdict'] != 'valid':
+        write_log(f"{company_name}: Skipping PDF, Already Checked ({cached['verdict']}) | URL: {url}")
+        crawl_state.record_candidate(company_name, url, cached['verdict'], cached['content_hash'])
         return None
-    
-    # Set download request headers
+
+    # Set download request headers, with the validators of the valid PDF for a conditional request
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         'Accept': 'application/pdf'
     }
+    reusable = has_cached_pdf(cached)
+    if reusable:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
 
-    # Create PDF file path
-    pdf_path = f"./reports/{company_name}.pdf"
-
-    for trial in range(max_trials): # Try up to 3 times
-        try:
-            # Send request
-            response = requests.get(url, headers=headers, verify=False, timeout=30)
-            
-            # If request successful, process PDF file
-            if response.status_code == 200:
-                with open(pdf_path, 'wb') as f:
-                    f.write(response.content)
-                
-                # Check if PDF content contains scope 1 or scope 2
-                text = extract_text_from_pdf(pdf_path) # Only extract the page that contains scope 1 or scope 2
-                if text == None or text == "": 
-                    write_log(f"{company_name}: PDF content does not contain 'scope 1' or 'scope 2' | URL: {url}")
-                    if os.path.exists(pdf_path):
-                        os.remove(pdf_path)
-                    return None
-                else:
-                    write_log(f"{company_name}: Valid PDF downloaded | URL: {url}")
+    try:
+        # Send request through the shared session, the body is streamed instead of loaded into memory
+        # The host slot only covers the time to the response headers, the host latency,
+        # and is given back before the body is read, so hosts of large PDFs are not seen as slow
+        with time_stage('download'):
+            with HOST_SCHEDULER.slot(url) as outcome:
+                response = get_http_session().get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=True)
+                outcome['status'] = response.status_code
+                outcome['retry_after'] = response.headers.get('Retry-After')
+            with response:
+                # If the PDF is not modified, reuse the file downloaded before
+                if response.status_code == 304 and reusable:
+                    if race and not race.win():
+                        return None
+                    if os.path.abspath(cached['file_path']) != os.path.abspath(pdf_path):
+                        shutil.copyfile(cached['file_path'], pdf_path)
+                    write_log(f"{company_name}: Valid PDF not modified, reused | URL: {url}")
+                    crawl_state.record_candidate(company_name, url, 'valid', cached['content_hash'])
                     return pdf_path
-        
-        # If there is an error, and not reached max trials, wait 2 seconds and retry
-        except Exception as e:
-            if trial < max_trials - 1:
-                time.sleep(2)
-                continue
+                # If the host is throttling or failing, try again later
+                if response.status_code in RETRY_STATUS_CODES and not last_trial:
+                    return RETRY
+                # If request failed, stop trying
+                if response.status_code != 200:
+                    write_log(f"{company_name}: Failed to download PDF | Status: {response.status_code} | URL: {url}")
+                    crawl_state.record_candidate(company_name, url, 'failed')
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        crawl_state.save_url_verdict(url, 'failed')
+                    return None
+                rejection = save_pdf_response(response, temp_path, race)
+                if race and race.is_cancelled():
+                    write_log(f"{company_name}: Download cancelled, another PDF is valid | URL: {url}")
+                    remove_file(temp_path)
+                    return None
+                if rejection:
+                    write_log(f"{company_name}: {rejection} | URL: {url}")
+                    crawl_state.record_candidate(company_name, url, 'rejected')
+                    crawl_state.save_url_verdict(url, 'rejected')
+                    remove_file(temp_path)
+                    return None
+                validators = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            
+        # Check if PDF content contains scope 1 or scope 2, stop at the first page found
+        # Not cached, most candidates are thrown away, the kept PDF is cached when its text is extracted
+        with time_stage('validation'):
+            content_hash = hash_file(temp_path)
+            is_valid = has_scope_page(temp_path, use_cache=False)
+        if not is_valid:
+            write_log(f"{company_name}: PDF content does not contain 'scope 1' or 'scope 2' | URL: {url}")
+            crawl_state.record_candidate(company_name, url, 'invalid', content_hash)
+            crawl_state.save_url_verdict(url, 'invalid', content_hash)
+            remove_file(temp_path)
+            return None
+        elif race and not race.win():
+            write_log(f"{company_name}: Valid PDF discarded, another PDF is valid | URL: {url}")
+            crawl_state.record_candidate(company_name, url, 'valid', content_hash)
+            remove_file(temp_path)
+            return None
+        else:
+            os.replace(temp_path, pdf_path)
+            write_log(f"{company_name}: Valid PDF downloaded | URL: {url}")
+            crawl_state.record_candidate(company_name, url, 'valid', content_hash)
+            crawl_state.save_url_verdict(url, 'valid', content_hash, pdf_path, *validators)
+            return pdf_path
+    
+    # The crawl engine waits for the host and runs the attempt again
+    except HostBusy:
+        raise
+    # If there is an error, and not reached max trials, retry after the host backoff
+    except Exception as e:
+        remove_file(temp_path)
+        if race and race.is_cancelled():
+            return None
+        if not last_trial:
+            return RETRY
+        write_log(f"{company_name}: PDF Processing Error | Error: {e} | URL: {url}")
+        crawl_state.record_candidate(company_name, url, 'error')
+        return None
+
+# Helper Function: Download PDF file (including verify whether content contains scope 1 or scope 2)
+def download_pdf(company_name, url, max_trials=3, race=None):
+    
+    # Check if URL is PDF
+    if 'pdf' not in url:
+        write_log(f"{company_name}: Is not a PDF URL | URL: {url}")
+        crawl_state.record_candidate(company_name, url, 'not_pdf')
+        return None
 
-            # If reached max trials, delete PDF file
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-            write_log(f"{company_name}: PDF Processing Error | Error: {e} | URL: {url}")
+    for trial in range(max_trials): # Try up to 3 times
+        if race and race.is_cancelled():
             return None
+        result = download_pdf_attempt(company_name, url, last_trial=(trial == max_trials - 1), race=race)
+        if result != RETRY:
+            return result
     
-    # If all attempts failed, delete file path
+    # If all attempts failed
     write_log(f"{company_name}: Failed to download PDF after {max_trials} attempts | URL: {url}")
-    if os.path.exists(pdf_path):
-        os.remove(pdf_path)
+    crawl_state.record_candidate(company_name, url, 'error')
     return None
 
-# Step 1: Try to search PDF directly in Bing
-def search_pdf_in_bing(driver, company_name):
+# HTML parser collecting (href, text) of every link, and of Bing results (".b_algo h2 a")
+class LinkParser(HTMLParser):
+    VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = []
+        self.result_links = []
+        self.open_tags = [] # (tag, is Bing result container)
+        self.current_link = None # [href, text parts, is Bing result]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'base' and attrs.get('href'):
+            self.base_url = urllib.parse.urljoin(self.base_url, attrs['href'])
+        if tag == 'a':
+            href = attrs.get('href')
+            is_result = any(name == 'h2' for name, _ in self.open_tags) and \
+                        any(is_container for _, is_container in self.open_tags)
+            self.current_link = [urllib.parse.urljoin(self.base_url, href) if href else None, [], is_result]
+        if tag not in self.VOID_TAGS:
+            self.open_tags.append((tag, 'b_algo' in (attrs.get('class') or '').split()))
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self.current_link:
+            href, text_parts, is_result = self.current_link
+            self.current_link = None
+            if href and href.startswith(('http://', 'https://')):
+                link = (href, " ".join("".join(text_parts).split()))
+                self.links.append(link)
+                if is_result:
+                    self.result_links.append(link)
+        # Close the tag and any unclosed tags inside it
+        for i in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[i][0] == tag:
+                del self.open_tags[i:]
+                break
+
+    def handle_data(self, data):
+        if self.current_link:
+            self.current_link[1].append(data)
+
+# Helper Function: Download the candidate PDFs, return the path of the first valid one
+# The best SPECULATIVE_DOWNLOADS candidates are downloaded at the same time, and the next candidate starts
+# whenever one of them is rejected
+def download_first_valid_pdf(company_name, pdf_links):
+    if SPECULATIVE_DOWNLOADS <= 1 or len(pdf_links) < 2:
+        for pdf in pdf_links:
+            pdf_path = download_pdf(company_name, pdf)
+            if pdf_path:
+                return pdf_path
+        return None
+
+    race = DownloadRace()
+    executor = ThreadPoolExecutor(max_workers=min(SPECULATIVE_DOWNLOADS, len(pdf_links)))
+    try:
+        futures = [executor.submit(download_pdf, company_name, pdf, race=race) for pdf in pdf_links]
+        for future in as_completed(futures):
+            pdf_path = future.result()
+            if pdf_path:
+                return pdf_path
+        return None
+    finally:
+        # Stop the downloads still running, and drop the candidates not started
+        race.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# Helper Function: Get (size, content type) of a candidate PDF with a HEAD request
+# Sample output:
+#       ("https://www.acer.com/report.pdf", (5242880, "application/pdf")), ("https://example.com/a.pdf", None)
+def get_pdf_head(url):
+    try:
+        with HOST_SCHEDULER.slot(url) as outcome:
+            response = get_http_session().head(url, headers=BROWSER_HEADERS, timeout=HTTP_TIMEOUT, allow_redirects=True)
+            outcome['status'] = response.status_code
+            outcome['retry_after'] = response.headers.get('Retry-After')
+    except requests.RequestException:
+        return url, None
+    # Many hosts do not answer HEAD requests, then nothing is known about the candidate
+    if response.status_code != 200:
+        return url, None
+    size = response.headers.get('Content-Length', '')
+    return url, (int(size) if size.isdigit() else None, response.headers.get('Content-Type'))
+
+# Helper Function: Get (size, content type) of candidate PDFs with HEAD requests
+# Sample output:
+#       {"https://www.acer.com/report.pdf": (5242880, "application/pdf"), "https://example.com/a.pdf": None}
+def get_pdf_heads(pdf_links):
+    with ThreadPoolExecutor(max_workers=RANKING_HEAD_WORKERS) as executor:
+        return dict(executor.map(get_pdf_head, pdf_links))
+
+# Helper Function: Sort candidate PDFs by score, the most likely sustainability report first
+# candidates: [(url, link text)]
+def rank_pdf_links(company_name, candidates):
+    if len(candidates) < 2:
+        return [url for url, _ in candidates]
+    heads = get_pdf_heads([url for url, _ in candidates]) if RANKING_HEAD_REQUESTS else None
+    return rank_candidates(company_name, candidates, heads)
+
+# Helper Function: Get links of a page over plain HTTP
+# The body is only read for text/html pages, and at most MAX_PAGE_SIZE bytes of it
+# Return None if the page can not be fetched or has no links (then the browser is needed)
+def fetch_links_http(url, results_only=False):
+    try:
+        # The host slot is only held until the headers arrive
+        with HOST_SCHEDULER.slot(url) as outcome:
+            response = get_http_session().get(url, headers=BROWSER_HEADERS, timeout=HTTP_TIMEOUT, stream=True)
+            outcome['status'] = response.status_code
+            outcome['retry_after'] = response.headers.get('Retry-After')
+        with response:
+            if response.status_code != 200 or 'text/html' not in response.headers.get('Content-Type', '').lower():
+                return None
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                body.extend(chunk)
+                if len(body) >= MAX_PAGE_SIZE:
+                    break
+    except requests.RequestException:
+        return None
+    try:
+        page = bytes(body[:MAX_PAGE_SIZE]).decode(response.encoding or 'utf-8', errors='replace')
+    except LookupError: # unknown charset in the Content-Type
+        page = bytes(body[:MAX_PAGE_SIZE]).decode('utf-8', errors='replace')
+    parser = LinkParser(response.url)
+    parser.feed(page)
+    parser.close()
+    links = parser.result_links if results_only else parser.links
+    return links or None
+
+# Helper Function: Get (href, text) of links on a page, over plain HTTP first, with Selenium as fallback
+# Sample output:
+#       [("https://www.apple.com/environment/pdf/Apple_Environmental_Progress_Report_2024.pdf", "Environmental Progress Report")]
+def get_links(get_driver, company_name, url, search_query):
+    if DISCOVERY_MODE == 'http':
+        links = fetch_links_http(url, results_only=(search_query == BING_RESULT_QUERY))
+        if links:
+            return links
+
+    driver = get_driver()
+    search_results = get_search_results(driver, company_name, url, search_query)
+    if not search_results:
+        return None
+
+    # Read all links at once in the browser
+    links = harvest_links(driver, search_query)
+    if links != None:
+        return links
+
+    # If the script failed, read the elements one by one
+    links = []
+    for result in search_results:
+        try:
+            links.append((result.get_attribute('href'), result.text))
+        except Exception:
+            # If element is stale, continue to next one
+            continue
+    return links
+
+# Helper Function: Get (href, text) of all elements matching a Selenium query with a single script call
+# Return None if the query has no CSS equivalent or the script failed
+def harvest_links(driver, search_query):
+    by, value = search_query
+    if by not in (By.CSS_SELECTOR, By.TAG_NAME):
+        return None
+    try:
+        results = driver.execute_script(HARVEST_LINKS_SCRIPT, value)
+    except WebDriverException:
+        return None
+    return [(href, " ".join((text or "").split())) for href, text in results or []]
+
+# Helper Function: Build the Bing search url of a query
+def get_bing_search_url(search_query):
+    return f"{BING_SEARCH_URL}?q={urllib.parse.quote(search_query)}&first=1&form=QBRE"
+
+# Helper Function: Get (href, text) of the Bing results of a query, reusing the results of previous passes
+def get_search_links(get_driver, company_name, search_query):
+    search_results = crawl_state.load_search_results(search_query)
+    if search_results != None:
+        write_log(f"{company_name}: Using Cached Search Results | Query: {search_query}")
+        return search_results
+
+    with time_stage('search'):
+        search_results = get_links(get_driver, company_name, get_bing_search_url(search_query), BING_RESULT_QUERY)
+    # Failed searches are not cached, so they are tried again
+    if search_results:
+        crawl_state.save_search_results(search_query, search_results)
+    return search_results
+
+# Step 1 (links): Find PDF links directly in Bing search results
+# rank: return the links in score order, otherwise the unranked candidates [(url, link text)]
+def find_pdf_links_in_bing(get_driver, company_name, rank=True):
     
     # Search query
     search_query = f"{company_name} sustainability report 2024 pdf -responsibilityreports"
-    search_url = f"https://www.bing.com/search?q={urllib.parse.quote(search_query)}&first=1&form=QBRE"
+    search_url = get_bing_search_url(search_query)
+
+    # Skip the search if a previous pass already tried all its results
+    if crawl_state.is_query_done(company_name, search_query):
+        write_log(f"{company_name}: Skipping PDF Search, All Results Tried | URL: {search_url}")
+        return None
     write_log(f"{company_name}: Searching PDF in Bing | URL: {search_url}")
 
     # Call helper function to get search results
-    search_query = (By.CSS_SELECTOR, '.b_algo h2 a')
-    search_results = get_search_results(driver, company_name, search_url, search_query)
+    search_results = get_search_links(get_driver, company_name, search_query)
     
     # If no search results found, return None
     if not search_results:
         write_log(f"{company_name}: No Search Results Found | URL: {search_url}")
+        crawl_state.record_query(company_name, search_query, None)
         return None
 
     # Extract PDF links from search results
     pdf_links = []
-    for result in search_results:
-        url = result.get_attribute('href').lower()
-        if url and '.pdf' in url:
-            pdf_links.append(url)   
+    link_texts = {}
+    for url, text in search_results:
+        if url and '.pdf' in url.lower():
+            pdf_links.append(url)
+            link_texts[url] = text
+    crawl_state.record_query(company_name, search_query, pdf_links)
 
     # If no PDF links found, return None
     if not pdf_links:
         write_log(f"{company_name}: No PDF Links Found in Search Results | URL: {search_url}")
         return None
 
+    # Only the links not tried in previous passes, or worth retrying, in score order
+    pending_links = crawl_state.filter_pending_urls(company_name, pdf_links)
+    candidates = [(url, link_texts[url]) for url in pending_links]
+    if not rank:
+        return candidates or None
+    return rank_pdf_links(company_name, candidates) or None
+
+# Step 1: Try to search PDF directly in Bing
+def search_pdf_in_bing(get_driver, company_name):
+    pdf_links = find_pdf_links_in_bing(get_driver, company_name)
+    if not pdf_links:
+        return None
+
     # Try to download PDF (only pdf content contains scope 1 or scope 2 will be downloaded)
-    for pdf in pdf_links:
-        pdf_path = download_pdf(company_name, pdf)
-        if pdf_path:
-            return pdf_path
-        
-    write_log(f"{company_name}: No Valid PDF Found in Search Results")
-    return None
+    pdf_path = download_first_valid_pdf(company_name, pdf_links)
+    if not pdf_path:
+        write_log(f"{company_name}: No Valid PDF Found in Search Results")
+    return pdf_path
 
 # Step 2: If PDF not found directly in Bing, search company's sustainability website
-def search_webpage_in_bing(driver, company_name):
+def search_webpage_in_bing(get_driver, company_name):
     
     # Search query
     search_query = f"{company_name} sustainability report -responsibilityreports"
-    search_url = f"https://www.bing.com/search?q={urllib.parse.quote(search_query)}&first=1&form=QBRE"
+    search_url = get_bing_search_url(search_query)
+
+    # Skip the search if a previous pass already scanned all its webpages
+    if crawl_state.is_query_done(company_name, search_query):
+        write_log(f"{company_name}: Skipping Webpage Search, All Results Tried | URL: {search_url}")
+        return None
     write_log(f"{company_name}: Searching Webpage in Bing | URL: {search_url}")
         
     # Call helper function to get search results
-    search_query = (By.CSS_SELECTOR, '.b_algo h2 a')
-    search_results = get_search_results(driver, company_name, search_url, search_query)
+    search_results = get_search_links(get_driver, company_name, search_query)
 
     # If no search results found, return None
     if not search_results:
         write_log(f"{company_name}: No Search Results Found | URL: {search_url}")
+        crawl_state.record_query(company_name, search_query, None)
         return None
     
     # Extract first 3 non-PDF webpage links from search results
     url_list = []
-    count = 0
-    for result in search_results:
-        if count >= 3:
+    for url, _ in search_results:
+        if len(url_list) >= 3:
             break
-        try:
-            url = result.get_attribute('href')
-            if url and '.pdf' not in url.lower(): # Only non-PDF links will be added
-                url_list.append(url)
-                count += 1
-        except Exception as e:
-            write_log(f"{company_name}: Error getting URL from search result: {str(e)}")
-            continue
+        if url and '.pdf' not in url.lower(): # Only non-PDF links will be added
+            url_list.append(url)
+    crawl_state.record_query(company_name, search_query, url_list)
 
     # If no valid URL found, return None
     if not url_list:
         write_log(f"{company_name}: No Valid URL Found in Search Results")
         return None
             
-    return url_list
+    # Only the webpages not scanned in previous passes
+    return crawl_state.filter_pending_urls(company_name, url_list) or None
 
-# Step 3: Find PDF links in company's sustainability website
-def find_pdf_in_webpage(driver, company_name, url):
+# Step 3 (links): Find PDF links in company's sustainability website
+# rank: return the links in score order, otherwise the unranked candidates [(url, link text)]
+def find_pdf_links_in_webpage(get_driver, company_name, url, rank=True):
 
+    # Skip the webpage if a previous pass already tried all its PDFs
+    if crawl_state.is_query_done(company_name, url):
+        write_log(f"{company_name}: Skipping Webpage, All PDFs Tried | URL: {url}")
+        return None
     write_log(f"{company_name}: Searching PDF in Webpage | URL: {url}")
 
-    # Call helper function to get search results
-    search_query = (By.TAG_NAME, "a")
-    search_results = get_search_results(driver, company_name, url, search_query)
+    # Call helper function to get links in the webpage
+    with time_stage('link_scan'):
+        search_results = get_links(get_driver, company_name, url, LINK_QUERY)
 
     # If no search results found, return None
     if not search_results:
         write_log(f"{company_name}: No Search Results Found | URL: {url}")
+        crawl_state.record_query(company_name, url, None)
         return None
     
     # Extract PDF links from search results
     pdf_links = []
-    for result in search_results:
-        try:
-            # Get href attribute of link
-            href = result.get_attribute('href')
-            if not href:  # Skip if href is None or empty string
-                continue
+    link_texts = {}
+    keywords = ['report', 'esg', 'sustainability', 'impact', 'environment', 'green', 'carbon', 'emissions']
+    for href, text in search_results:
+        if not href:  # Skip if href is None or empty string
+            continue
 
-            # Check if link is PDF
-            is_pdf = ('.pdf' in href.lower())
+        # Check if link is PDF
+        is_pdf = ('.pdf' in href.lower())
 
-            # Check if link text contains keywords
-            text = result.text.lower()
-            keywords = ['report', 'esg', 'sustainability', 'impact', 'environment', 'green', 'carbon', 'emissions']
-            has_keywords = any(keyword in text for keyword in keywords)
-            
-            # Check if it's PDF and contains keywords
-            if is_pdf and has_keywords and (href not in pdf_links):
-                pdf_links.append(href)
-                
-        except Exception as e:
-            # If element is stale, continue to next one
-            continue
+        # Check if link text contains keywords
+        has_keywords = any(keyword in (text or "").lower() for keyword in keywords)
+        
+        # Check if it's PDF and contains keywords
+        if is_pdf and has_keywords and (href not in pdf_links):
+            pdf_links.append(href)
+            link_texts[href] = text
     write_log(f"{company_name}: Found {len(pdf_links)} PDF on webpage.")
 
+    # Only the 10 best scored PDFs are checked, and only those not tried in previous passes
+    # The score does not need HEAD requests here, it only picks the 10 PDFs
+    if len(pdf_links) > 10:
+        pdf_links = rank_candidates(company_name, [(href, link_texts[href]) for href in pdf_links])[:10]
+    crawl_state.record_query(company_name, url, pdf_links)
     if not pdf_links:
         return None
+    pending_links = crawl_state.filter_pending_urls(company_name, pdf_links)
+    candidates = [(href, link_texts[href]) for href in pending_links]
+    if not rank:
+        return candidates or None
+    return rank_pdf_links(company_name, candidates) or None
+
+# Helper Function: Record a webpage without valid PDF, it is finished once all its PDFs are tried
+def record_webpage_scanned(company_name, url):
+    outcome = 'scanned' if crawl_state.is_query_done(company_name, url) else 'error'
+    crawl_state.record_candidate(company_name, url, outcome)
+
+# Step 3: Find PDF in company's sustainability website
+def find_pdf_in_webpage(get_driver, company_name, url):
+    pdf_links = find_pdf_links_in_webpage(get_driver, company_name, url)
+    if not pdf_links:
+        record_webpage_scanned(company_name, url)
+        return None
+
+    # Download and check the PDFs
+    pdf_path = download_first_valid_pdf(company_name, pdf_links)
+    if not pdf_path:
+        write_log(f"{company_name}: No Valid PDF Found in Webpage")
+        record_webpage_scanned(company_name, url)
+    return pdf_path
 
-    # Download and check first 10 PDFs
-    for pdf in pdf_links[:10]:
-        pdf_path = download_pdf(company_name, pdf)
-        if pdf_path:
-            return pdf_path
-    
-    write_log(f"{company_name}: No Valid PDF Found in Webpage")
-    return None
         
+# Record the result of a company in the statistics
+# result: 'direct' (PDF found in Bing), 'webpage' (PDF found in webpage) or None (failed)
+def record_company_result(company_name, result):
+    metrics = METRICS
+    if metrics != None:
+        metrics.record_result(company_name, result)
+
 # Process single company
 def process_company(company_name):
 
     print(f"Processing {company_name}...")
-    driver = init_driver()
+    with lazy_driver() as get_driver:
     
-    # 1. Search PDF directly
-    pdf_url = search_pdf_in_bing(driver, company_name)
-    if pdf_url:
-        with threading.Lock():  # Use lock to protect shared resource access
-            STATS['direct_pdf_success'] += 1
-        driver.quit()
-        return pdf_url
-    
-    # 2. If PDF not found, search webpage, and find PDF in webpage
-    webpage_url_list = search_webpage_in_bing(driver, company_name)
-    if webpage_url_list:
-        for url in webpage_url_list:
-            pdf_url = find_pdf_in_webpage(driver, company_name, url)
-            if pdf_url: 
-                with threading.Lock():  # Use lock to protect shared resource access
-                    STATS['webpage_pdf_success'] += 1
-                driver.quit()
-                return pdf_url
-    
-    # If all methods failed
-    with threading.Lock():  # Use lock to protect shared resource access
-        STATS['failed_companies'].append(company_name)
-    driver.quit()
+        # 1. Search PDF directly
+        pdf_url = search_pdf_in_bing(get_driver, company_name)
+        if pdf_url:
+            record_company_result(company_name, 'direct')
+            return pdf_url
+        
+        # 2. If PDF not found, search webpage, and find PDF in webpage
+        webpage_url_list = search_webpage_in_bing(get_driver, company_name)
+        if webpage_url_list:
+            for url in webpage_url_list:
+                pdf_url = find_pdf_in_webpage(get_driver, company_name, url)
+                if pdf_url: 
+                    record_company_result(company_name, 'webpage')
+                    return pdf_url
+        
+        # If all methods failed
+        record_company_result(company_name, None)
 
-# Process a batch of companies
-def process_batch(table_name, total_batches, batch_num):
+# Helper Function: Run a step function with a WebDriver borrowed only for this step
+def run_with_driver(function, *args):
+    with lazy_driver() as get_driver:
+        return function(get_driver, *args)
 
-    print(f"\nStarting Batch {batch_num}...")
-    
-    # Initialize global statistics
-    global STATS
-    STATS = {
-        'total_companies': 0,
-        'direct_pdf_success': 0,
-        'webpage_pdf_success': 0,
-        'failed_companies': []
-    }
+# Async crawl engine: search, link scan and download are separate stages with their own limits,
+# so hundreds of downloads can be in flight while only a few searches use the browsers
+# Blocking work runs in a thread pool large enough for all stages
+class CrawlEngine:
+    def __init__(self, companies=CRAWL_COMPANIES, searches=CRAWL_SEARCHES,
+                 page_scans=CRAWL_PAGE_SCANS, downloads=CRAWL_DOWNLOADS):
+        self.companies = companies
+        self.limits = {'search': searches, 'page_scan': page_scans, 'download': downloads}
+        self.semaphores = None
+        self.executor = None
+
+    # Run the blocking work of a stage in the thread pool
+    # A busy or blocked host is waited for here with wait_async, outside the stage limit, then the work runs again
+    # The runs share one progress dict (HOST_SCHEDULER.get_progress), so retries are not reset by a rerun
+    async def run_stage(self, stage, function, *args):
+        loop = asyncio.get_running_loop()
+        progress = {}
+        for rerun in range(HOST_BUSY_MAX_RERUNS):
+            async with self.semaphores[stage]:
+                try:
+                    return await loop.run_in_executor(self.executor, HOST_SCHEDULER.run_in_engine,
+                                                      progress, True, function, *args)
+                except HostBusy as e:
+                    busy_url = e.url
+            await HOST_SCHEDULER.wait_async(busy_url)
+        async with self.semaphores[stage]:
+            return await loop.run_in_executor(self.executor, HOST_SCHEDULER.run_in_engine, progress, False, function, *args)
+
+    # Same as rank_pdf_links, but each HEAD request is a unit of the download stage,
+    # so the search and page scan slots are released before the candidates are ranked
+    async def rank_pdf_links(self, company_name, candidates):
+        if len(candidates) < 2:
+            return [url for url, _ in candidates]
+        heads = None
+        if RANKING_HEAD_REQUESTS:
+            heads = dict(await asyncio.gather(*(self.run_stage('download', get_pdf_head, url) for url, _ in candidates)))
+        # The feature weights are learned from the crawl logs on first use
+        return await asyncio.to_thread(rank_candidates, company_name, candidates, heads)
+
+    # Same as download_pdf, but waiting for a busy or blocked host does not hold a download worker
+    async def download_pdf(self, company_name, url, max_trials=3, race=None):
+        if 'pdf' not in url:
+            write_log(f"{company_name}: Is not a PDF URL | URL: {url}")
+            await asyncio.to_thread(crawl_state.record_candidate, company_name, url, 'not_pdf')
+            return None
+        for trial in range(max_trials):
+            await HOST_SCHEDULER.wait_async(url)
+            if race and race.is_cancelled():
+                return None
+            result = await self.run_stage('download', download_pdf_attempt, company_name, url, trial == max_trials - 1, race)
+            if result != RETRY:
+                return result
+        write_log(f"{company_name}: Failed to download PDF after {max_trials} attempts | URL: {url}")
+        await asyncio.to_thread(crawl_state.record_candidate, company_name, url, 'error')
+        return None
+
+    # Download the candidate PDFs, each download is a separate unit of the download stage
+    # Same as download_first_valid_pdf, up to SPECULATIVE_DOWNLOADS candidates of the company at the same time
+    async def download_first_valid_pdf(self, company_name, pdf_links):
+        if SPECULATIVE_DOWNLOADS <= 1 or len(pdf_links) < 2:
+            for pdf in pdf_links:
+                pdf_path = await self.download_pdf(company_name, pdf)
+                if pdf_path:
+                    return pdf_path
+            return None
+
+        race = DownloadRace()
+        semaphore = asyncio.Semaphore(SPECULATIVE_DOWNLOADS)
+
+        async def download_candidate(pdf):
+            async with semaphore:
+                return await self.download_pdf(company_name, pdf, race=race)
+
+        tasks = [asyncio.create_task(download_candidate(pdf)) for pdf in pdf_links]
+        try:
+            for task in asyncio.as_completed(tasks):
+                pdf_path = await task
+                if pdf_path:
+                    return pdf_path
+            return None
+        finally:
+            # Stop the downloads still running, and drop the candidates not started
+            race.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Same steps as process_company, return the PDF path and the result for record_company_result
+    async def process_company(self, company_name):
+        print(f"Processing {company_name}...")
+
+        # 1. Search PDF directly
+        await HOST_SCHEDULER.wait_async(BING_SEARCH_URL)
+        candidates = await self.run_stage('search', run_with_driver, find_pdf_links_in_bing, company_name, False)
+        if candidates:
+            pdf_links = await self.rank_pdf_links(company_name, candidates)
+            pdf_path = await self.download_first_valid_pdf(company_name, pdf_links)
+            if pdf_path:
+                return pdf_path, 'direct'
+            write_log(f"{company_name}: No Valid PDF Found in Search Results")
+
+        # 2. If PDF not found, search webpage, and find PDF in webpage
+        await HOST_SCHEDULER.wait_async(BING_SEARCH_URL)
+        webpage_url_list = await self.run_stage('search', run_with_driver, search_webpage_in_bing, company_name)
+        for url in webpage_url_list or []:
+            await HOST_SCHEDULER.wait_async(url)
+            candidates = await self.run_stage('page_scan', run_with_driver, find_pdf_links_in_webpage, company_name, url, False)
+            if not candidates:
+                await asyncio.to_thread(record_webpage_scanned, company_name, url)
+                continue
+            pdf_links = await self.rank_pdf_links(company_name, candidates)
+            pdf_path = await self.download_first_valid_pdf(company_name, pdf_links)
+            if pdf_path:
+                return pdf_path, 'webpage'
+            write_log(f"{company_name}: No Valid PDF Found in Webpage")
+            await asyncio.to_thread(record_webpage_scanned, company_name, url)
+
+        # If all methods failed
+        return None, None
+
+    def start(self):
+        self.semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in self.limits.items()}
+        self.executor = ThreadPoolExecutor(max_workers=sum(self.limits.values()))
+
+    # Crawl one company, return the result for record_company_result
+    async def crawl_company(self, company_name):
+        try:
+            _, result = await self.process_company(company_name)
+        except Exception as e:
+            write_log(f"{company_name}: Crawl Error | Error: {e}")
+            result = None
+        return result
+
+    # Crawl all companies and record their results
+    async def crawl(self, company_names):
+        self.start()
+        company_semaphore = asyncio.Semaphore(self.companies)
+
+        async def crawl_company(company_name):
+            async with company_semaphore:
+                record_company_result(company_name, await self.crawl_company(company_name))
+
+        try:
+            await asyncio.gather(*(crawl_company(company_name) for company_name in company_names))
+        finally:
+            self.executor.shutdown(wait=True)
+
+    # Crawl the companies of the shared work queue until none is left
+    # A company is claimed as soon as another one finishes, so the worker never waits for the slowest company
+    # Failed companies go back to the queue, and are only recorded as failed when given up
+    async def crawl_queue(self, worker_id):
+        self.start()
+        claimed = set()
+
+        async def crawl_company(company_name):
+            result = await self.crawl_company(company_name)
+            finished = await asyncio.to_thread(crawl_state.complete_company, company_name, result != None)
+            if result or finished:
+                record_company_result(company_name, result)
+
+        tasks = set()
+        try:
+            while True:
+                # Fill the free company slots from the queue
+                if len(tasks) < self.companies:
+                    count = min(QUEUE_CLAIM_SIZE, self.companies - len(tasks))
+                    for company_name in await asyncio.to_thread(crawl_state.claim_companies, worker_id, count):
+                        if company_name not in claimed:
+                            claimed.add(company_name)
+                            if METRICS != None:
+                                METRICS.add_company()
+                        tasks.add(asyncio.create_task(crawl_company(company_name)))
+
+                if tasks:
+                    _, tasks = await asyncio.wait(tasks, timeout=QUEUE_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                # Nothing in flight, wait for the next company due to retry, or stop if the queue is empty
+                wait = await asyncio.to_thread(crawl_state.get_queue_wait)
+                if wait == None:
+                    break
+                await asyncio.sleep(max(wait, QUEUE_POLL_INTERVAL))
+        finally:
+            self.executor.shutdown(wait=True)
+
+# Process all companies through the shared work queue of the crawl state
+# Several processes, or hosts sharing the crawl state file, can run at the same time, each claiming the next
+# companies from the queue, so a full pass takes as long as the total work and not the slowest batch
+def process_queue(table_name, max_workers=CRAWLER_WORKERS, worker_id=None, retry_failed=False):
+
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    print(f"\nStarting Worker {worker_id}...")
     
     # Create logs directory (if not exists)
     os.makedirs('./logs', exist_ok=True)
     
-    # Set global log filename
-    global LOG_FILENAME
-    LOG_FILENAME = f'./logs/crawler_batch{batch_num}_log.txt'
-    summary_filename = f'./logs/crawler_batch{batch_num}_summary.txt'
+    # Set log filenames of this worker
+    log_filename = f'./logs/crawler_{worker_id}_log.txt'
+    events_filename = f'./logs/crawler_{worker_id}_events.jsonl'
+    summary_filename = f'./logs/crawler_{worker_id}_summary.txt'
     
     # Get company list from database
     query = f"SELECT company_name FROM {table_name}"
     companies = get_data(query)
     
-    # Get company list for corresponding batch
-    batch_companies = [
-        company['company_name'] 
-        for i, company in enumerate(companies) 
-        if i % total_batches == (batch_num - 1)
-    ]
-    
     # Get list of existing PDF files
     existing_pdfs = {
         os.path.splitext(f)[0] 
@@ -329,74 +1321,74 @@ def process_batch(table_name, total_batches, batch_num):
         if f.endswith('.pdf')
     }
 
-    # Filter out companies that already have PDFs
-    companies_to_process = [
-        company_name 
-        for company_name in batch_companies 
-        if company_name not in existing_pdfs
-    ]
+    # Queue the companies that have no PDF yet (companies already queued keep their attempts)
+    crawl_state.enqueue_companies([
+        company['company_name']
+        for company in companies
+        if company['company_name'] not in existing_pdfs
+    ], retry_failed=retry_failed)
 
     # Add start delimiter to log
-    with open(LOG_FILENAME, 'a', encoding='utf-8') as f:
+    with open(log_filename, 'a', encoding='utf-8') as f:
         start_time = datetime.datetime.now()
         f.write("="*50 + "\n")
         f.write(f"Start Time: {start_time.strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write("="*50 + "\n")
-
-    STATS['total_companies'] = len(companies_to_process)
     
+    # Start the statistics and the log writer of this run
+    global METRICS
+    metrics = METRICS = CrawlMetrics(log_filename, events_filename)
     
-    # Use ThreadPoolExecutor for parallel processing
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [
-            executor.submit(process_company, company_name)
-            for company_name in companies_to_process
-        ]
-        wait(futures)
-
-    '''
-    # Without using threads
-    for company_name in companies_to_process:
-        process_company(company_name)
-    '''
+    # Use the async crawl engine for parallel processing
+    # Share max_workers WebDrivers between all companies instead of launching Chrome for every company
+    global DRIVER_POOL
+    DRIVER_POOL = DriverPool(max_workers)
+    try:
+        if DISCOVERY_MODE == 'selenium':
+            DRIVER_POOL.warm_up()
+        asyncio.run(CrawlEngine().crawl_queue(worker_id))
+    finally:
+        # Later log lines are printed, the writer thread of this run is stopped
+        DRIVER_POOL.close()
+        METRICS = None
+        metrics.close()
     
     # Generate summary report
+    stats = metrics.get_stats()
     with open(summary_filename, 'a', encoding='utf-8') as f:
         f.write("="*50 + "\n")
-        f.write(f"Crawler Summary Report - Batch {batch_num}\n")
-        f.write(f"Total Companies: {STATS['total_companies']}\n")
-        f.write(f"Direct PDF Search Success: {STATS['direct_pdf_success']}\n")
-        f.write(f"Webpage PDF Search Success: {STATS['webpage_pdf_success']}\n")
-        f.write(f"Failed Companies: {len(STATS['failed_companies'])}\n")
+        f.write(f"Crawler Summary Report - Worker {worker_id}\n")
+        f.write(f"Total Companies: {stats['total_companies']}\n")
+        f.write(f"Direct PDF Search Success: {stats['direct_pdf_success']}\n")
+        f.write(f"Webpage PDF Search Success: {stats['webpage_pdf_success']}\n")
+        f.write(f"Failed Companies: {len(stats['failed_companies'])}\n")
+        http_stats = get_http_stats()
+        f.write(f"HTTP Requests: {http_stats['requests']} (New Connections: {http_stats['connections']}, Reused: {http_stats['reused']})\n")
+        f.write(f"{DRIVER_POOL.summary()}\n")
+        f.write(f"{HOST_SCHEDULER.summary()}\n")
+        for line in metrics.summary_lines():
+            f.write(f"{line}\n")
         f.write("\nList of Failed Companies:\n")
-        for company in STATS['failed_companies']:
+        for company in stats['failed_companies']:
             f.write(f"- {company}\n")
         f.write("\n" + "="*50 + "\n")
     
     # Add end delimiter to log
-    with open(LOG_FILENAME, 'a', encoding='utf-8') as f:
+    with open(log_filename, 'a', encoding='utf-8') as f:
         end_time = datetime.datetime.now()
         f.write("="*50 + "\n")
         f.write(f"End Time: {end_time.strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write("="*50 + "\n")
     
-    print(f"Batch {batch_num} completed")
+    print(f"Worker {worker_id} completed")
 
 # Process a batch of companies
-def process_missing_reports(table_name):
+def process_missing_reports(table_name, max_workers=4):
 
     print(f"\nStarting...")
     
-    global STATS
-    STATS = {
-        'total_companies': 0,
-        'direct_pdf_success': 0,
-        'webpage_pdf_success': 0,
-        'failed_companies': []
-    }
-    
-    global LOG_FILENAME
-    LOG_FILENAME = f'./logs/crawler_missing_reports_log.txt'
+    log_filename = f'./logs/crawler_missing_reports_log.txt'
+    events_filename = f'./logs/crawler_missing_reports_events.jsonl'
     summary_filename = f'./logs/crawler_missing_reports_summary.txt'
     
     query = f"SELECT company_name FROM {table_name}"
@@ -420,34 +1412,49 @@ def process_missing_reports(table_name):
         for company in companies_to_process:
             f.write(company + '\n')
 
-    with open(LOG_FILENAME, 'a', encoding='utf-8') as f:
+    with open(log_filename, 'a', encoding='utf-8') as f:
         start_time = datetime.datetime.now()
         f.write("="*50 + "\n")
         f.write(f"Start Time: {start_time.strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write("="*50 + "\n")
 
-    STATS['total_companies'] = len(companies_to_process)
+    global METRICS
+    metrics = METRICS = CrawlMetrics(log_filename, events_filename)
+    metrics.add_company(len(companies_to_process))
     
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [
-            executor.submit(process_company, company_name)
-            for company_name in companies_to_process
-        ]
-        wait(futures)
+    # Use the async crawl engine, sharing max_workers WebDrivers between all companies
+    global DRIVER_POOL
+    DRIVER_POOL = DriverPool(max_workers)
+    try:
+        if DISCOVERY_MODE == 'selenium':
+            DRIVER_POOL.warm_up()
+        asyncio.run(CrawlEngine().crawl(companies_to_process))
+    finally:
+        # Later log lines are printed, the writer thread of this run is stopped
+        DRIVER_POOL.close()
+        METRICS = None
+        metrics.close()
     
+    stats = metrics.get_stats()
     with open(summary_filename, 'a', encoding='utf-8') as f:
         f.write("="*50 + "\n")
         f.write(f"Crawler Summary Report - Missing Reports\n")
-        f.write(f"Total Companies: {STATS['total_companies']}\n")
-        f.write(f"Direct PDF Search Success: {STATS['direct_pdf_success']}\n")
-        f.write(f"Webpage PDF Search Success: {STATS['webpage_pdf_success']}\n")
-        f.write(f"Failed Companies: {len(STATS['failed_companies'])}\n")
+        f.write(f"Total Companies: {stats['total_companies']}\n")
+        f.write(f"Direct PDF Search Success: {stats['direct_pdf_success']}\n")
+        f.write(f"Webpage PDF Search Success: {stats['webpage_pdf_success']}\n")
+        f.write(f"Failed Companies: {len(stats['failed_companies'])}\n")
+        http_stats = get_http_stats()
+        f.write(f"HTTP Requests: {http_stats['requests']} (New Connections: {http_stats['connections']}, Reused: {http_stats['reused']})\n")
+        f.write(f"{DRIVER_POOL.summary()}\n")
+        f.write(f"{HOST_SCHEDULER.summary()}\n")
+        for line in metrics.summary_lines():
+            f.write(f"{line}\n")
         f.write("\nList of Failed Companies:\n")
-        for company in STATS['failed_companies']:
+        for company in stats['failed_companies']:
             f.write(f"- {company}\n")
         f.write("\n" + "="*50 + "\n")
     
-    with open(LOG_FILENAME, 'a', encoding='utf-8') as f:
+    with open(log_filename, 'a', encoding='utf-8') as f:
         end_time = datetime.datetime.now()
         f.write("="*50 + "\n")
         f.write(f"End Time: {end_time.strftime('%Y-%m-%d %H:%M:%S')}\n")
@@ -460,15 +1467,10 @@ if __name__ == "__main__":
     #company_name = "APPLE"
     #process_company(company_name)
 
-    # Batch processing
+    # Queue processing, each company is tried up to crawl_state.QUEUE_MAX_ATTEMPTS times
+    # More workers can join the same queue with process_queue(table_name), e.g. in other terminals
     table_name = "emissions_data"
-    total_batches = 10  # Divide the whole list into 10 batches
-    attempt_times = 8  # Each batch try 8 times
-
-    for i in range(attempt_times):
-        for j in range(total_batches):
-            batch_num = j + 1
-            process_batch(table_name, total_batches, batch_num)
+    process_queue(table_name, retry_failed=True)
 
     # Process missing reports
     # process_missing_reports(table_name)
@@ -0,0 +1,269 @@
+import os
+import time
+import asyncio
+import resource
+import tempfile
+import threading
+import urllib.parse
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import crawler
+import crawl_state
+from crawl_metrics import CrawlMetrics
+
+# Fake web settings
+# Companies crawled in each run
+BENCH_COMPANIES = 200
+# Pages and padded size (bytes) of each synthetic PDF
+BENCH_PDF_PAGES = 20
+BENCH_PDF_SIZE = 2 * 1024 * 1024
+# Seconds added to every response, to simulate the network
+BENCH_LATENCY = 0.05
+# Out of every 10 companies: PDF found in search results, PDF found on the sustainability webpage, no PDF
+BENCH_DIRECT_COMPANIES = 5
+BENCH_WEBPAGE_COMPANIES = 3
+# PDFs without scope 1 / scope 2 listed before the valid one
+BENCH_INVALID_PDFS = 2
+
+
+# Build a PDF with one text page per item of pages, padded with a comment to at least size bytes
+def make_pdf(pages, size=0):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        stream = "BT /F1 10 Tf 50 750 Td 12 TL " + " ".join(f"({line}) Tj T*" for line in text.split("\n")) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    pdf = "%PDF-1.4\n"
+    # Padding comment lines, ignored by PDF readers
+    while len(pdf) < size:
+        pdf += "%" + "x" * 1023 + "\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(pdf))
+        pdf += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return pdf.encode('latin-1')
+
+
+# Get the synthetic company names
+# Sample output:
+#       ["BENCH COMPANY 0000", "BENCH COMPANY 0001", ...]
+def get_company_names(count=BENCH_COMPANIES):
+    return [f"BENCH COMPANY {i:04d}" for i in range(count)]
+
+# Get where the valid PDF of a company is: 'direct' (search results), 'webpage' or None
+def get_company_profile(company_name):
+    index = int(company_name.split()[-1]) % 10
+    if index < BENCH_DIRECT_COMPANIES:
+        return 'direct'
+    if index < BENCH_DIRECT_COMPANIES + BENCH_WEBPAGE_COMPANIES:
+        return 'webpage'
+    return None
+
+
+# Local web serving Bing-like search results, sustainability webpages and PDFs
+# /search?q=<query>          search results of the company in the query
+# /site/<company>/           sustainability webpage of a company
+# /pdf/<company>/<name>.pdf  report.pdf and esg.pdf are valid, other PDFs have no scope 1 / scope 2
+class FakeWeb:
+    def __init__(self, latency=BENCH_LATENCY, pdf_pages=BENCH_PDF_PAGES, pdf_size=BENCH_PDF_SIZE):
+        self.latency = latency
+        # The scope 1 page is in the middle, so validation reads half of the PDF
+        pages = [f"Annual report page {i + 1}\nBusiness overview" for i in range(pdf_pages)]
+        valid_pages = list(pages)
+        valid_pages[pdf_pages // 2] = "Greenhouse gas emissions 2024\nScope 1 emissions: 1,234 tCO2e\nScope 2 emissions: 2,345 tCO2e"
+        self.valid_pdf = make_pdf(valid_pages, pdf_size)
+        self.invalid_pdf = make_pdf(pages, pdf_size)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.server = None
+
+    def get_page(self, path, query):
+        parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/')]
+        if parts[0] == 'search':
+            search_query = query.get('q', [''])[0]
+            company_name = search_query.split(' sustainability report')[0]
+            slug = urllib.parse.quote(company_name)
+            if 'pdf' in search_query:
+                links = [(f"/pdf/{slug}/old{i}.pdf", f"{company_name} Annual Report {2020 + i}") for i in range(BENCH_INVALID_PDFS)]
+                if get_company_profile(company_name) == 'direct':
+                    links.append((f"/pdf/{slug}/report.pdf", f"{company_name} Sustainability Report 2024"))
+            else:
+                links = [(f"/site/{slug}/", f"{company_name} Sustainability"), ("/about/", "About")]
+            results = "".join(f'<li class="b_algo"><h2><a href="{href}">{text}</a></h2></li>' for href, text in links)
+            return 'text/html', f'<html><body><ol id="b_results">{results}</ol></body></html>'.encode()
+        if parts[0] == 'site' and len(parts) > 1:
+            slug = urllib.parse.quote(parts[1])
+            links = [(f"/pdf/{slug}/old{i}.pdf", "Sustainability report archive") for i in range(BENCH_INVALID_PDFS)]
+            if get_company_profile(parts[1]) == 'webpage':
+                links.append((f"/pdf/{slug}/esg.pdf", "ESG report 2024"))
+            body = "".join(f'<a href="{href}">{text}</a>' for href, text in links)
+            return 'text/html', f'<html><body><nav><a href="/">Home</a></nav>{body}</body></html>'.encode()
+        if parts[0] == 'pdf' and len(parts) > 2:
+            return 'application/pdf', self.valid_pdf if parts[2] in ('report.pdf', 'esg.pdf') else self.invalid_pdf
+        if parts[0] in ('', 'about'):
+            return 'text/html', b'<html><body><nav><a href="/">Home</a></nav><p>Nothing here</p></body></html>'
+        return None, None
+
+    def start(self):
+        web = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, like real servers
+
+            def do_GET(self):
+                with web.lock:
+                    web.requests += 1
+                time.sleep(web.latency)
+                url = urllib.parse.urlparse(self.path)
+                content_type, body = web.get_page(url.path, urllib.parse.parse_qs(url.query))
+                if body == None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Run one crawl against the fake web, in a fresh working directory and crawl state
+# engine: 'engine' (CrawlEngine.crawl), 'queue' (CrawlEngine.crawl_queue) or 'threads' (process_company in a thread pool)
+# Sample output:
+#       {'engine': 'engine', 'passes': [{'companies': 200, 'seconds': 12.3, 'companies_per_min': 975.6, 'found': 160, ...}],
+#        'peak_rss_mb': 180.2}
+def run_benchmark(base_url, engine='engine', company_names=None, workers=crawler.CRAWLER_WORKERS,
+                  host_concurrency=64, discovery_mode='http', passes=1):
+    company_names = company_names or get_company_names()
+    # The working directory is removed at the end, and the previous one restored
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='crawler_benchmark_') as work_dir:
+        os.chdir(work_dir)
+        try:
+            return run_passes(base_url, engine, company_names, workers, host_concurrency, discovery_mode, passes, work_dir)
+        finally:
+            os.chdir(original_dir)
+
+
+# Run the passes of run_benchmark in the working directory work_dir
+def run_passes(base_url, engine, company_names, workers, host_concurrency, discovery_mode, passes, work_dir):
+    os.makedirs('./reports', exist_ok=True)
+    os.makedirs('./logs', exist_ok=True)
+
+    crawl_state.CRAWL_STATE_PATH = os.path.join(work_dir, 'crawl_state.sqlite')
+    crawler.BING_SEARCH_URL = f"{base_url}/search"
+    crawler.DISCOVERY_MODE = discovery_mode
+    # All fake sites are on one local host, so the per-host limits are raised to measure the crawler itself
+    crawler.HOST_SCHEDULER = crawler.HostScheduler(max_concurrency=host_concurrency)
+    crawler.HTTP_CONNECTIONS_PER_HOST = host_concurrency
+
+    results = []
+    for pass_num in range(passes):
+        # Like a rerun of the crawler, later passes only crawl the companies without PDF,
+        # and reuse the crawl state of the previous passes
+        existing_pdfs = {os.path.splitext(f)[0] for f in os.listdir('./reports') if f.endswith('.pdf')}
+        pass_companies = [company_name for company_name in company_names if company_name not in existing_pdfs]
+        crawler.HTTP_SESSION = None
+        metrics = crawler.METRICS = CrawlMetrics(f'./logs/bench_pass{pass_num + 1}_log.txt', f'./logs/bench_pass{pass_num + 1}_events.jsonl')
+        crawler.DRIVER_POOL = crawler.DriverPool(workers)
+        metrics.add_company(len(pass_companies))
+
+        start_time = time.perf_counter()
+        try:
+            if discovery_mode == 'selenium':
+                crawler.DRIVER_POOL.warm_up()
+                start_time = time.perf_counter()
+            if engine == 'engine':
+                asyncio.run(crawler.CrawlEngine().crawl(pass_companies))
+            elif engine == 'queue':
+                crawl_state.enqueue_companies(pass_companies, retry_failed=True)
+                asyncio.run(crawler.CrawlEngine().crawl_queue('benchmark'))
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(crawler.process_company, pass_companies))
+        finally:
+            seconds = time.perf_counter() - start_time
+            crawler.DRIVER_POOL.close()
+            crawler.METRICS = None
+            metrics.close()
+
+        stats = metrics.get_stats()
+        http_stats = crawler.get_http_stats()
+        results.append({
+            'companies': len(pass_companies),
+            'seconds': seconds,
+            'companies_per_min': len(pass_companies) / seconds * 60,
+            'found': stats['direct_pdf_success'] + stats['webpage_pdf_success'],
+            'failed': len(stats['failed_companies']),
+            'stages': metrics.get_timings(),
+            'http_requests': http_stats['requests'],
+            'connections': http_stats['connections'],
+            'drivers_created': crawler.DRIVER_POOL.stats['created']
+        })
+
+    # ru_maxrss is in KB on Linux
+    return {
+        'engine': engine,
+        'passes': results,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+# Run a benchmark in a new process, so peak memory and global state are not shared between runs
+def run_benchmark_in_process(base_url, **options):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_benchmark, base_url, **options).result()
+
+
+# Print a benchmark result
+def print_benchmark(result, expected_found):
+    print("="*100)
+    print(f"Engine: {result['engine']} | Companies with a valid PDF: {expected_found} | Peak RSS: {result['peak_rss_mb']:.1f} MB")
+    for pass_num, run in enumerate(result['passes']):
+        print(f"Pass {pass_num + 1}: {run['companies']} companies, {run['companies_per_min']:.1f} companies/min ({run['seconds']:.2f}s), "
+              f"Found: {run['found']}, Failed: {run['failed']}, "
+              f"HTTP Requests: {run['http_requests']}, Connections: {run['connections']}, Drivers: {run['drivers_created']}")
+        for stage, timing in run['stages'].items():
+            print(f"    {stage}: {timing['count']} calls, p50 {timing['p50'] * 1000:.0f}ms, "
+                  f"p90 {timing['p90'] * 1000:.0f}ms, p99 {timing['p99'] * 1000:.0f}ms, max {timing['max'] * 1000:.0f}ms")
+    print("="*100)
+
+
+if __name__ == "__main__":
+    # Compare the crawler engines on the same fake web, with 2 passes to see the effect of the crawl state
+    web = FakeWeb()
+    base_url = web.start()
+    company_names = get_company_names()
+    expected_found = sum(1 for company_name in company_names if get_company_profile(company_name))
+
+    try:
+        for engine in ['threads', 'engine', 'queue']:
+            result = run_benchmark_in_process(base_url, engine=engine, company_names=company_names, passes=2)
+            print_benchmark(result, expected_found)
+        print(f"Requests served by the fake web: {web.requests}")
+    finally:
+        web.stop()
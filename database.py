@@ -1,4 +1,7 @@
 import os
+import time
+import queue
+import threading
 import mysql.connector
 from mysql.connector import pooling
 from dotenv import load_dotenv
@@ -15,6 +18,11 @@ db_config = {
     "ssl_ca": os.getenv('DB_SSL_CA')
 }
 
+# Rows written per multi-row statement and transaction by bulk_upsert
+BULK_CHUNK_SIZE = 1000
+# BufferedWriter flushes when this many rows are buffered, or when the oldest row waited this many seconds
+WRITER_BATCH_SIZE = 100
+WRITER_FLUSH_INTERVAL = 10
 
 # Database connection pool
 connection_pool = None
@@ -94,6 +102,114 @@ def insert_data(insert_data_query, data):
         cursor.close()
         connection.close()
 
+# Insert many rows, one multi-row statement and one commit per chunk
+# Rows whose unique key already exists are updated instead, so loading the same data again is idempotent
+# update_columns: columns updated on duplicate key (default: all columns)
+# Sample input:
+#       "emissions_data", ["company_name", "isin", "weight"], [("APPLE INC", "US0378331005", "4.5"), ...], ["company_name", "weight"]
+def bulk_upsert(table_name, columns, rows, update_columns=None, chunk_size=BULK_CHUNK_SIZE, show_progress=True):
+    update_columns = update_columns or columns
+    query = f"""
+        INSERT INTO {table_name} ({", ".join(columns)})
+        VALUES ({", ".join(["%s"] * len(columns))})
+        ON DUPLICATE KEY UPDATE {", ".join(f"{column} = VALUES({column})" for column in update_columns)}
+        """
+    rows = list(rows)
+    connection = get_connection()
+    try:
+        cursor = connection.cursor()
+        for start in range(0, len(rows), chunk_size):
+            # The connector sends the chunk as one multi-row INSERT
+            try:
+                cursor.executemany(query, rows[start:start + chunk_size])
+                connection.commit()
+            except mysql.connector.Error:
+                connection.rollback()
+                raise
+            if show_progress:
+                print(f"{table_name}: {min(start + chunk_size, len(rows))}/{len(rows)} rows written")
+    finally:
+        cursor.close()
+        connection.close()
+
+# Rows upserted by a background thread in batches, so the callers never wait for the database
+# Sample usage:
+#       writer = BufferedWriter("emissions_data", ["company_name", "isin", "scope1_direct"], ["scope1_direct"])
+#       writer.add(("APPLE INC", "US0378331005", "55200"))
+#       failed_rows = writer.close()
+class BufferedWriter:
+    def __init__(self, table_name, columns, update_columns=None,
+                 batch_size=WRITER_BATCH_SIZE, flush_interval=WRITER_FLUSH_INTERVAL):
+        self.table_name = table_name
+        self.columns = columns
+        self.update_columns = update_columns
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows = queue.Queue()
+        self.written = 0
+        self.commits = 0
+        self.failed_rows = [] # rows that could not be written, retried once more when the writer is closed
+        self.writer = threading.Thread(target=self.write_rows, name=f"{table_name}-writer", daemon=True)
+        self.writer.start()
+
+    # Queue a row, returns immediately
+    def add(self, row):
+        self.rows.put(row)
+
+    # Write rows in one transaction, if it fails write them one by one, so only the failing rows are left out
+    # Rows that still fail are kept in failed_rows
+    def write_batch(self, rows):
+        try:
+            bulk_upsert(self.table_name, self.columns, rows, self.update_columns, show_progress=False)
+            self.written += len(rows)
+            self.commits += 1
+            print(f"{self.table_name}: {len(rows)} rows written ({self.written} in total)")
+            return
+        except Exception as e:
+            print(f"{self.table_name}: Failed to write {len(rows)} rows, writing them one by one: {e}")
+        for row in rows:
+            try:
+                bulk_upsert(self.table_name, self.columns, [row], self.update_columns, show_progress=False)
+                self.written += 1
+                self.commits += 1
+            except Exception as e:
+                print(f"{self.table_name}: Failed to write row {row[0]}: {e}")
+                self.failed_rows.append(row)
+
+    # Writer thread: collect rows until the batch is full or too old, then write them in one transaction
+    # Any error is caught, so the thread keeps running and a failing row never holds back the other rows
+    def write_rows(self):
+        buffer = []
+        first_time = None
+        closed = False
+        while not closed:
+            timeout = None if first_time == None else max(0, first_time + self.flush_interval - time.monotonic())
+            try:
+                row = self.rows.get(timeout=timeout)
+                if row == None:
+                    closed = True
+                else:
+                    buffer.append(row)
+                    first_time = first_time or time.monotonic()
+            except queue.Empty:
+                pass
+            if closed:
+                # Rows failed earlier get one more try, e.g. after the database was unreachable for a while
+                buffer = self.failed_rows + buffer
+                self.failed_rows = []
+            if buffer and (closed or len(buffer) >= self.batch_size or
+                           time.monotonic() - first_time >= self.flush_interval):
+                self.write_batch(buffer)
+                buffer = []
+                first_time = None
+
+    # Write the remaining rows and stop the writer thread
+    # Return the rows that could not be written, empty if all rows are saved
+    def close(self):
+        self.rows.put(None)
+        self.writer.join()
+        return self.failed_rows
+
 
 # Delete data from database
 def delete_data(company_name, table_name):
@@ -0,0 +1,277 @@
+import time
+import json
+import random
+import asyncio
+
+import openai
+from openai import AsyncOpenAI
+
+import cache
+import process_pdf
+from process_pdf import (
+    LLM_PROVIDERS, PDF_WORKERS, get_llm_client_config, get_llm_cache_key, get_llm_batch_cache_key,
+    estimate_tokens, build_batch_request,
+    iter_extracted_reports, record_emissions_data, find_data_in_text_fast_path, print_fast_path_stats
+)
+
+# Maximum number of LLM requests in flight
+LLM_CONCURRENCY = 16
+# Rate limits of the LLM account
+LLM_REQUESTS_PER_MINUTE = 500
+LLM_TOKENS_PER_MINUTE = 200000
+# Expected tokens of one answer, counted in the token rate limit
+LLM_ANSWER_TOKENS = 200
+# Retry settings for rate limited (429), server error (5xx) and connection errors
+LLM_MAX_RETRIES = 5
+LLM_BACKOFF_BASE = 1
+LLM_BACKOFF_MAX = 60
+
+# Batch the companies whose text is shorter than LLM_BATCH_EXCERPT_TOKENS into one request
+LLM_BATCH_ENABLED = True
+LLM_BATCH_EXCERPT_TOKENS = 1500
+# Limits of one batch request, and seconds to wait for more companies before sending a batch
+LLM_BATCH_TOKEN_BUDGET = 8000
+LLM_BATCH_MAX_COMPANIES = 10
+LLM_BATCH_WAIT = 2
+
+
+# Token bucket rate limiter, refilled continuously up to one minute of capacity
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    # Wait until the amount is available, callers are served in order
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+# Check if a LLM error is worth retrying
+def is_retryable_error(e):
+    if isinstance(e, openai.APIConnectionError): # Including timeout
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+# Get the seconds to wait before retrying, use Retry-After if the server sent it
+def get_retry_delay(e, attempt):
+    response = getattr(e, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        return min(float(retry_after), LLM_BACKOFF_MAX)
+    except (TypeError, ValueError):
+        # Exponential backoff with jitter
+        return random.uniform(0.5, 1) * min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt)
+
+
+# Send LLM requests concurrently with a limit on requests in flight, requests per minute and tokens per minute
+class AsyncLLMExtractor:
+    def __init__(self, provider='chatgpt', concurrency=LLM_CONCURRENCY,
+                 requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 base_url=None, api_key=None, bypass_cache=False):
+        default_api_key, default_base_url = get_llm_client_config(provider)
+        # The SDK retries are disabled, retries are handled here with the rate limits
+        self.client = AsyncOpenAI(
+            api_key=api_key or default_api_key,
+            base_url=base_url or default_base_url,
+            max_retries=0
+        )
+        self.provider = provider
+        self.build_request = LLM_PROVIDERS[provider]['build_request']
+        self.bypass_cache = bypass_cache or process_pdf.LLM_CACHE_BYPASS
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+
+    # Get the cached answer of a company, return None if not cached
+    # With batch, answers split out of earlier batch requests are used too, the single request never uses them
+    # The cache is read in a thread, so the disk access does not block the event loop
+    async def load_cached_answer(self, company_name, pdf_text, batch=False):
+        if self.bypass_cache:
+            return None
+        cache_key = get_llm_cache_key(self.provider, self.build_request(company_name, pdf_text))
+        answer = await asyncio.to_thread(cache.load_llm_answer, cache_key)
+        if answer == None and batch:
+            batch_cache_key = get_llm_batch_cache_key(self.provider, company_name, pdf_text)
+            answer = await asyncio.to_thread(cache.load_llm_answer, batch_cache_key)
+        return answer
+
+    # Send one request with rate limiting and retries, return the answer text or None if failed
+    async def send_request(self, request, label):
+        tokens = sum(estimate_tokens(message['content']) for message in request['messages']) + LLM_ANSWER_TOKENS
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self.request_bucket.acquire()
+            await self.token_bucket.acquire(tokens)
+            try:
+                async with self.semaphore:
+                    response = await self.client.chat.completions.create(**request)
+                return response.choices[0].message.content.strip()
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == LLM_MAX_RETRIES:
+                    print(f"Error calling LLM API for {label}: {e}")
+                    return None
+                await asyncio.sleep(get_retry_delay(e, attempt))
+
+    # Find the specific emissions data in text, same answer as find_data_in_text_chatgpt / deepseek
+    # Return None if the request failed after all retries
+    async def find_data_in_text(self, company_name, pdf_text):
+        answer = await self.load_cached_answer(company_name, pdf_text)
+        if answer != None:
+            return answer
+
+        request = self.build_request(company_name, pdf_text)
+        answer = await self.send_request(request, company_name)
+        if answer != None:
+            await asyncio.to_thread(cache.save_llm_answer, get_llm_cache_key(self.provider, request), answer)
+        return answer
+
+    # Find the emissions data of several companies in one request
+    # Sample output:
+    #       {"APPLE INC": "Scope 1 (direct): 1,234 t CO2e. ...", "NVIDIA CORP": "..."}
+    #       None if the request failed or the answer is not a json object
+    async def find_data_in_batch(self, excerpts):
+        request = build_batch_request(self.provider, excerpts)
+        answer = await self.send_request(request, f"batch of {len(excerpts)} companies")
+        try:
+            answers = json.loads(answer) if answer != None else None
+        except ValueError:
+            print(f"Error parsing LLM batch answer: {answer[:200]}")
+            return None
+        if not isinstance(answers, dict):
+            return None
+
+        # Cache each answer under its batch key, apart from the answers of single requests
+        for company_name, pdf_text in excerpts:
+            company_answer = answers.get(company_name)
+            if isinstance(company_answer, str) and company_answer.strip():
+                batch_cache_key = get_llm_batch_cache_key(self.provider, company_name, pdf_text)
+                await asyncio.to_thread(cache.save_llm_answer, batch_cache_key, company_answer.strip())
+        return answers
+
+    async def close(self):
+        await self.client.close()
+
+
+# Collect companies with short texts into batch requests
+# A batch is sent when it is full, its token budget would be exceeded, or after LLM_BATCH_WAIT seconds
+# Companies missing from the batch answer are sent again as single requests
+class LLMBatcher:
+    def __init__(self, extractor, token_budget=LLM_BATCH_TOKEN_BUDGET,
+                 max_companies=LLM_BATCH_MAX_COMPANIES, wait=LLM_BATCH_WAIT):
+        self.extractor = extractor
+        self.token_budget = token_budget
+        self.max_companies = max_companies
+        self.wait = wait
+        self.pending = [] # (company_name, pdf_text, future)
+        self.pending_tokens = 0
+        self.timer = None
+        self.tasks = [] # Keep references to the running batches
+
+    # Same answer as AsyncLLMExtractor.find_data_in_text
+    async def find_data_in_text(self, company_name, pdf_text):
+        answer = await self.extractor.load_cached_answer(company_name, pdf_text, batch=True)
+        if answer != None:
+            return answer
+
+        tokens = estimate_tokens(pdf_text)
+        if self.pending and (self.pending_tokens + tokens > self.token_budget or
+                             company_name in (pending[0] for pending in self.pending)):
+            self.flush()
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((company_name, pdf_text, future))
+        self.pending_tokens += tokens
+        if len(self.pending) >= self.max_companies:
+            self.flush()
+        elif self.timer == None:
+            self.timer = asyncio.get_running_loop().call_later(self.wait, self.flush)
+        return await future
+
+    # Send the pending companies as one batch
+    def flush(self):
+        if self.timer != None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending, self.pending_tokens = self.pending, [], 0
+        if batch:
+            self.tasks.append(asyncio.create_task(self.send_batch(batch)))
+
+    async def send_batch(self, batch):
+        try:
+            excerpts = [(company_name, pdf_text) for company_name, pdf_text, _ in batch]
+            answers = await self.extractor.find_data_in_batch(excerpts) if len(batch) > 1 else None
+
+            async def resolve(company_name, pdf_text, future):
+                answer = answers.get(company_name) if answers else None
+                if isinstance(answer, str) and answer.strip():
+                    answer = answer.strip()
+                else:
+                    # Fall back to the single request
+                    answer = await self.extractor.find_data_in_text(company_name, pdf_text)
+                future.set_result(answer)
+
+            await asyncio.gather(*(resolve(*pending) for pending in batch))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+# Extract reports in the process pool and find emissions data with concurrent LLM requests
+# on_result(index, result) is called as soon as each company is done (not in order)
+# result is the same as find_emissions_data, e.g. (True, "1234", "2345", "3456", "-") or None
+async def find_emissions_data_async(company_names, log_file_path, csv_file_path, on_result=None,
+                                    provider='chatgpt', max_workers=PDF_WORKERS, batch=LLM_BATCH_ENABLED, **llm_options):
+    extractor = AsyncLLMExtractor(provider, **llm_options)
+    batcher = LLMBatcher(extractor)
+
+    # Short texts go through the batcher, long texts are sent alone
+    async def find_data_in_text(company_name, pdf_text):
+        if batch and estimate_tokens(pdf_text) <= LLM_BATCH_EXCERPT_TOKENS:
+            return await batcher.find_data_in_text(company_name, pdf_text)
+        return await extractor.find_data_in_text(company_name, pdf_text)
+
+    async def process_company(index, company_name, report):
+        result = None
+        if report != None:
+            fiscal_year, pdf_text = report
+            data_in_text = find_data_in_text_fast_path(pdf_text) or await find_data_in_text(company_name, pdf_text)
+            result = record_emissions_data(company_name, fiscal_year, data_in_text, log_file_path, csv_file_path)
+        if on_result:
+            on_result(index, result)
+
+    # Start the LLM request of each report as soon as it is extracted
+    tasks = []
+    reports = iter_extracted_reports(company_names, max_workers=max_workers)
+    try:
+        index = 0
+        while True:
+            item = await asyncio.to_thread(next, reports, None)
+            if item == None:
+                break
+            company_name, report = item
+            tasks.append(asyncio.create_task(process_company(index, company_name, report)))
+            index += 1
+        await asyncio.gather(*tasks)
+        print_fast_path_stats()
+    finally:
+        reports.close()
+        await extractor.close()
+
+
+# Synchronous entry point of find_emissions_data_async
+def find_emissions_data_batch(company_names, log_file_path, csv_file_path, on_result=None, **options):
+    asyncio.run(find_emissions_data_async(company_names, log_file_path, csv_file_path, on_result, **options))
@@ -4,6 +4,7 @@ import csv
 
 from crawler import *
 from process_pdf import *
+from llm_pipeline import find_emissions_data_batch, LLM_CONCURRENCY
 import database as db
 
 # A test function to test creating a table
@@ -56,6 +57,7 @@ def create_table(table_name, file_path):
     db.create_table(create_table_query)
 
     
+    rows = []
     with open(file_path, "r", encoding="utf-8") as csvfile:
         reader = csv.reader(csvfile)
         next(reader)
@@ -67,11 +69,10 @@ def create_table(table_name, file_path):
             sector = row[4]
             area = row[5]
             country_region = row[6]
+            rows.append((name, ticker, isin, weight, sector, area, country_region))
 
-            insert_data_query = f"INSERT INTO {table_name} \
-                (company_name, ticker, isin, weight, sector, area, country_region) \
-                VALUES (%s, %s, %s, %s, %s, %s, %s)"
-            db.insert_data(insert_data_query, (name, ticker, isin, weight, sector, area, country_region))
+    # Load all rows in chunks, rows already in the table (same isin) are updated
+    db.bulk_upsert(table_name, ["company_name", "ticker", "isin", "weight", "sector", "area", "country_region"], rows)
 
 
 # Create table with only emissions data
@@ -93,6 +94,7 @@ def create_table_bloomberg_data(table_name, file_path):
     """
     db.create_table(create_table_query)
 
+    rows = []
     with open(file_path, "r", encoding="utf-8") as csvfile:
         reader = csv.reader(csvfile)
         next(reader) 
@@ -107,44 +109,50 @@ def create_table_bloomberg_data(table_name, file_path):
             scope1_direct = row[7]
             scope2_location = row[9]
             scope2_market = row[8]
+            rows.append((name, ticker, isin, weight, sector, area, country_region, scope1_direct, scope2_location, scope2_market))
 
-            insert_data_query = f"INSERT INTO {table_name} \
-                (company_name, ticker, isin, weight, sector, area, country_region, \
-                scope1_direct, scope2_location, scope2_market) \
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-            db.insert_data(insert_data_query, (name, ticker, isin, weight, sector, area, country_region, scope1_direct, scope2_location, scope2_market))
+    # Load all rows in chunks, rows already in the table (same isin) are updated
+    db.bulk_upsert(table_name, ["company_name", "ticker", "isin", "weight", "sector", "area", "country_region",
+                                "scope1_direct", "scope2_location", "scope2_market"], rows)
 
 
 # Fill emissions data into database
-def fill_emissions_data(table_name, log_file_path, csv_file_path):
+def fill_emissions_data(table_name, log_file_path, csv_file_path, max_workers=PDF_WORKERS, llm_concurrency=LLM_CONCURRENCY):
     
     # Get the whole company list
     get_data_query = f"SELECT * FROM {table_name}"
     results = db.get_data(get_data_query)
-    for result in results:
-
-        if result['scope1_direct'] != None or result['scope2_location'] != None \
-            or result['scope2_market'] != None or result['scope1_and_2'] != None:
-            continue
-
-        company_name = result['company_name']
-        isin = result['isin']
-
-        result = find_emissions_data(company_name, log_file_path, csv_file_path) or (None, None, None, None, None)
-        is_fiscal_year, scope1_direct, scope2_location, scope2_market, scope1_and_2 = result
-
-        insert_data_query = f"""
-            INSERT INTO  {table_name} (
-                company_name, isin, is_fiscal_year, scope1_direct, scope2_location, scope2_market, scope1_and_2
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                is_fiscal_year = VALUES(is_fiscal_year),
-                scope1_direct = VALUES(scope1_direct),
-                scope2_location = VALUES(scope2_location),
-                scope2_market = VALUES(scope2_market),
-                scope1_and_2 = VALUES(scope1_and_2);
-            """
-        db.insert_data(insert_data_query, (company_name, isin, is_fiscal_year, scope1_direct, scope2_location, scope2_market, scope1_and_2))
+
+    # Only process companies without emissions data
+    companies = [
+        (result['company_name'], result['isin'])
+        for result in results
+        if result['scope1_direct'] == None and result['scope2_location'] == None \
+            and result['scope2_market'] == None and result['scope1_and_2'] == None
+    ]
+    company_names = [company_name for company_name, _ in companies]
+
+    # Results are upserted in batches by a writer thread, rows with an existing isin are updated
+    writer = db.BufferedWriter(
+        table_name,
+        ["company_name", "isin", "is_fiscal_year", "scope1_direct", "scope2_location", "scope2_market", "scope1_and_2"],
+        ["is_fiscal_year", "scope1_direct", "scope2_location", "scope2_market", "scope1_and_2"]
+    )
+
+    # Queue the result of each company as soon as its LLM request is done
+    def save_result(index, result):
+        company_name, isin = companies[index]
+        is_fiscal_year, scope1_direct, scope2_location, scope2_market, scope1_and_2 = result or (None, None, None, None, None)
+        writer.add((company_name, isin, is_fiscal_year, scope1_direct, scope2_location, scope2_market, scope1_and_2))
+
+    # Extract pdf text in parallel, then find emissions data with concurrent LLM requests
+    try:
+        find_emissions_data_batch(company_names, log_file_path, csv_file_path, save_result,
+                                  max_workers=max_workers, concurrency=llm_concurrency)
+    finally:
+        failed_rows = writer.close()
+        if failed_rows:
+            print(f"Failed to save the results of {len(failed_rows)} companies: {', '.join(row[0] for row in failed_rows)}")
 
 
 
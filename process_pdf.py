@@ -2,22 +2,107 @@ import os
 import re
 import glob
 import csv
+import signal
+import datetime
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 
+import PyPDF2
 from PyPDF2 import PdfReader
 from dotenv import load_dotenv
 from openai import OpenAI
 
+import cache
+
+# Number of worker processes used to extract pdf text in batch processing
+PDF_WORKERS = os.cpu_count() or 1
+# Maximum seconds spent on one pdf before it is skipped
+PDF_TIMEOUT = 300
+
+# Version of the pdf text extraction, change it to invalidate the pdf text cache
+EXTRACTOR_VERSION = f"1-pypdf2-{PyPDF2.__version__}"
+
+# Keywords to determine if the pdf is a financial report
+FISCAL_YEAR_KEYWORDS = ['fy2', 'fiscal year']
+
+
+# Page predicate: the page mentions fiscal year
+def is_fiscal_year_page(page_text):
+    return any(keyword in page_text for keyword in FISCAL_YEAR_KEYWORDS)
+
+# Page predicate: the page contains ('scope 1' or 'scope 2') and ('2024' or '2023')
+def is_scope_page(page_text):
+    return ('scope 1' in page_text or 'scope 2' in page_text) and \
+           ('2024' in page_text or '2023' in page_text)
+
+
+# Scan the pdf in a single pass, each page text is extracted only once
+# predicates: {name: (predicate, mode)}, the predicate receives the lowercase page text
+#       mode "any": stop checking after the first matching page, result is True / False
+#       mode "all": collect the text of every matching page, result is a list of page texts
+# The scan stops early once every predicate is settled
+# Extracted pages and page matches are cached by the pdf content hash, so a rerun over
+# an unchanged pdf does not parse it again
+# Sample output:
+#       {'fiscal_year': True, 'scope': ['page text', 'page text']}
+def scan_pdf(pdf_path, predicates, use_cache=True):
+    results = {name: (False if mode == "any" else []) for name, (_, mode) in predicates.items()}
+    pending = {name: predicate for name, (predicate, mode) in predicates.items() if mode == "any"}
+    collecting = {name: predicate for name, (predicate, mode) in predicates.items() if mode == "all"}
+
+    # Load the pages extracted by previous scans of the same pdf
+    file_hash = cache.hash_file(pdf_path) if use_cache else None
+    entry = (use_cache and cache.load_pdf_cache(file_hash, EXTRACTOR_VERSION)) or {'num_pages': None, 'pages': [], 'matches': {}}
+    pages = entry['pages']
+    cached_count = len(pages)
+    cached_matches = {name: set(indexes) for name, indexes in entry['matches'].items()}
+
+    # Only open the pdf when a page is not cached
+    reader = None
+    if entry['num_pages'] == None or cached_count < entry['num_pages']:
+        reader = PdfReader(pdf_path)
+        entry['num_pages'] = len(reader.pages)
+
+    for i in range(entry['num_pages']):
+        # "all" predicates need every page, "any" predicates are settled by the first match
+        if not pending and not collecting:
+            break
+        if i < cached_count:
+            page_text = pages[i]
+        else:
+            page_text = reader.pages[i].extract_text() or ""
+            pages.append(page_text)
+        lower_text = page_text.lower()
+
+        for name, predicate in list(pending.items()) + list(collecting.items()):
+            if i < cached_count and name in cached_matches:
+                matched = i in cached_matches[name]
+            else:
+                matched = predicate(lower_text)
+            if not matched:
+                continue
+            if name in pending:
+                results[name] = True
+                del pending[name]
+            else:
+                results[name].append(page_text)
+
+    # Save new pages and page matches, every stored match list covers all cached pages
+    if use_cache and (len(pages) > cached_count or any(name not in cached_matches for name in predicates)):
+        if len(pages) > cached_count:
+            cached_matches = {}
+        for name, (predicate, _) in predicates.items():
+            if name not in cached_matches:
+                cached_matches[name] = {i for i, page_text in enumerate(pages) if predicate(page_text.lower())}
+        entry['matches'] = {name: sorted(indexes) for name, indexes in cached_matches.items()}
+        cache.save_pdf_cache(file_hash, EXTRACTOR_VERSION, entry)
+    return results
+
+
 # Determine if the pdf is a financial report
 def is_fiscal_year(pdf_path):
     try:
-        reader = PdfReader(pdf_path)
-        # Keywords to determine if the pdf is a financial report
-        keywords = ['fy2', 'fiscal year']
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if any(keyword in page_text.lower() for keyword in keywords):
-                return True
-        return False
+        return scan_pdf(pdf_path, {'fiscal_year': (is_fiscal_year_page, "any")})['fiscal_year']
     except Exception as e:
         print(f"Error checking if the pdf is a financial report: {e}")
         return None
@@ -26,15 +111,7 @@ def is_fiscal_year(pdf_path):
 # Extract text from pdf (only the page that contains ('scope 1' or 'scope 2') and ('2024' or '2023'))
 def extract_text_from_pdf(pdf_path):
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            # Only extract text if it contains 'scope 1' or 'scope 2' and '2024' or '2023'
-            if ('scope 1' in page_text.lower() or 'scope 2' in page_text.lower()) and \
-                  ('2024' in page_text.lower() or '2023' in page_text.lower()):
-                text += page_text
-        return text
+        return "".join(scan_pdf(pdf_path, {'scope': (is_scope_page, "all")})['scope'])
     
     except Exception as e:
         print(f"Error processing PDF: {pdf_path}")
@@ -42,20 +119,103 @@ def extract_text_from_pdf(pdf_path):
         return None
 
 
-# Find the specific emissions data in text using ChatGPT
-# Sample input: 
-#       pdf text
+# Check if the pdf has any page with scope 1 or scope 2 data, the scan stops at the first one
+# use_cache: False for pdfs that may be thrown away, so their pages are not kept in the cache
+def has_scope_page(pdf_path, use_cache=True):
+    try:
+        return scan_pdf(pdf_path, {'scope': (is_scope_page, "any")}, use_cache)['scope']
+
+    except Exception as e:
+        print(f"Error processing PDF: {pdf_path}")
+        print(f"Error message: {str(e)}")
+        return None
+
+
+# Check fiscal year and extract scope text with one parse of the pdf
 # Sample output:
-#       Scope 1 (direct): 1,234 t CO2e.
-#       Scope 2 (location-based): 2,345 t CO2e.
-#       Scope 2 (martket-based): 3,456 t CO2e.
-def find_data_in_text_chatgpt(company_name, pdf_text):  
+#       (True, "scope page text")
+#       (None, None) if the pdf can not be read
+def scan_report(pdf_path):
+    try:
+        results = scan_pdf(pdf_path, {
+            'fiscal_year': (is_fiscal_year_page, "any"),
+            'scope': (is_scope_page, "all")
+        })
+        return results['fiscal_year'], "".join(results['scope'])
+    
+    except Exception as e:
+        print(f"Error processing PDF: {pdf_path}")
+        print(f"Error message: {str(e)}")
+        return None, None
 
-    load_dotenv()
-    client = OpenAI(
-        api_key=os.getenv('OPENAI_API')
-    )
 
+# Maximum tokens of report text sent to the LLM, longer text is reduced to its most relevant chunks
+LLM_TEXT_TOKEN_BUDGET = 8000
+# Lines in one chunk, neighbouring chunks overlap so a table is not cut in half
+CHUNK_LINES = 30
+CHUNK_OVERLAP = 10
+
+# Keywords and units that indicate an emissions table
+CHUNK_KEYWORDS = ['scope 1', 'scope 2', 'location-based', 'market-based', 'location based', 'market based',
+                  'ghg', 'greenhouse gas', 'emissions', 'direct', 'indirect']
+CHUNK_UNITS = ['tco2e', 'tco2', 'co2e', 'co2-e', 'co2eq', 'tonnes', 'metric tons', 'metric tonnes']
+
+
+# Score a chunk of report text by keywords, units, years and table-like lines
+def score_chunk(lines):
+    text = "\n".join(lines).lower()
+    keyword_count = sum(text.count(keyword) for keyword in CHUNK_KEYWORDS)
+    unit_count = sum(text.count(unit) for unit in CHUNK_UNITS)
+    year_count = text.count('2024') + text.count('2023')
+    # A line with two or more numbers is likely a table row
+    table_lines = sum(1 for line in lines if len(re.findall(r"\d[\d,.]*", line)) >= 2)
+    return 3 * keyword_count + 2 * unit_count + year_count + table_lines
+
+
+# Reduce the report text to the highest scoring chunks within the token budget
+# The selected chunks are kept in their original order, gaps are marked with "..."
+def select_relevant_text(pdf_text, token_budget=LLM_TEXT_TOKEN_BUDGET):
+    if estimate_tokens(pdf_text) <= token_budget:
+        return pdf_text
+
+    # Split into overlapping windows of lines
+    lines = pdf_text.split("\n")
+    step = CHUNK_LINES - CHUNK_OVERLAP
+    windows = [range(start, min(start + CHUNK_LINES, len(lines))) for start in range(0, len(lines), step)]
+    windows.sort(key=lambda window: score_chunk(lines[window.start:window.stop]), reverse=True)
+
+    # Pack the best windows, overlapping lines are only counted once
+    selected = set()
+    used_tokens = 0
+    for window in windows:
+        new_lines = [i for i in window if i not in selected]
+        tokens = sum(estimate_tokens(lines[i]) for i in new_lines)
+        if used_tokens + tokens > token_budget:
+            continue
+        selected.update(new_lines)
+        used_tokens += tokens
+
+    # The best window alone is over the budget (e.g. very long lines), cut it to fit
+    if not selected:
+        best_text = "\n".join(lines[windows[0].start:windows[0].stop])
+        return best_text[:max(0, token_budget - 1) * 4]
+
+    parts = []
+    for i in sorted(selected):
+        if parts and i - 1 not in selected:
+            parts.append("...")
+        parts.append(lines[i])
+    return "\n".join(parts)
+
+
+SYSTEM_PROMPT = "You are a professional analyst who can find scope 1 and scope 2 emissions data from a company's sustainability report."
+CHATGPT_MODEL = "gpt-4o-mini"
+DEEPSEEK_MODEL = "deepseek-chat"
+
+
+# Build the ChatGPT request to find emissions data of a company
+def build_chatgpt_request(company_name, pdf_text):
+    pdf_text = select_relevant_text(pdf_text)
     prompt = f"According to the given text, find the latest scope 1 and scope 2 emissions data of \"{company_name}\",  \
                 and then give me the data in the one of following patterns.\n \
                 ##Pattern 1: \n \
@@ -71,59 +231,197 @@ def find_data_in_text_chatgpt(company_name, pdf_text):
                 4. If the data is missing or does not mention, leave the part as \"N/A\". \n \
                 ---------------------------------- \n \
                 {pdf_text}."
-
-    # Call the OpenAI ChatGPT API to analyze the content and find emission data
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system","content": "You are a professional analyst who can find scope 1 and scope 2 emissions data from a company's sustainability report."},
+    return {
+        'model': CHATGPT_MODEL,
+        'messages': [
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.7
+        'temperature': 0.7
+    }
+
+# Build the DeepSeek request to find emissions data of a company
+def build_deepseek_request(company_name, pdf_text):
+    pdf_text = select_relevant_text(pdf_text)
+    prompt = f"According to the given text, find the latest scope 1 and scope 2 emissions data of \"{company_name}\",  \
+                and then give me the data in the one of following patterns.\n \
+                ##Pattern 1: \n \
+                Scope 1 (direct): 1,234 unit. \n \
+                Scope 2 (location-based): 2,345 unit. \n \
+                Scope 2 (martket-based): 3,456 unit. \n \
+                ##Pattern 2 (only used when scope1 and scope2 are counted together): \n \
+                Scope 1 and 2 (total): 1,234 unit. \n \
+                ##Requirements: \n \
+                1. No any explanation needed. \n \
+                2. Pay attention and try hard to find the unit of the data.\n \
+                3. Pay more attention in the latter part of the content, as they often contain more accurate and detailed data. \n \
+                4. Pay attention to the calculation method of Scope 2.\n \
+                5. If the data is missing or not sure, leave the part as \"N/A\". \n \
+                ---------------------------------- \n \
+                {pdf_text}."
+    return {
+        'model': DEEPSEEK_MODEL,
+        'messages': [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        'stream': False
+    }
+
+
+# LLM providers: environment variables of the api key and base url, default base url and request builder
+# The base url can be pointed to any OpenAI-compatible server (e.g. a local stub for testing)
+LLM_PROVIDERS = {
+    'chatgpt': {
+        'api_key_env': 'OPENAI_API',
+        'base_url_env': 'OPENAI_BASE_URL',
+        'base_url': None,
+        'model': CHATGPT_MODEL,
+        'build_request': build_chatgpt_request
+    },
+    'deepseek': {
+        'api_key_env': 'DEEPSEEK_API',
+        'base_url_env': 'DEEPSEEK_BASE_URL',
+        'base_url': "https://api.deepseek.com",
+        'model': DEEPSEEK_MODEL,
+        'build_request': build_deepseek_request
+    }
+}
+
+
+# Build one request to find emissions data of several companies with short texts
+# The answer is a json object keyed by company name, each value in the same patterns as the single request
+# Sample input:
+#       [("APPLE INC", "pdf text"), ("NVIDIA CORP", "pdf text")]
+# Sample answer:
+#       {"APPLE INC": "Scope 1 (direct): 1,234 t CO2e.\nScope 2 (location-based): ...", "NVIDIA CORP": "..."}
+def build_batch_request(provider, excerpts):
+    company_names = [company_name for company_name, _ in excerpts]
+    texts = "".join(
+        f"##Company: \"{company_name}\"\n{select_relevant_text(pdf_text)}\n----------------------------------\n"
+        for company_name, pdf_text in excerpts
     )
+    prompt = f"For each company below, according to its given text, find the latest scope 1 and scope 2 emissions data of the company, \
+                and then give me the data in the one of following patterns.\n \
+                ##Pattern 1: \n \
+                Scope 1 (direct): 1,234 unit. \n \
+                Scope 2 (location-based): 2,345 unit. \n \
+                Scope 2 (market-based): 3,456 unit. \n \
+                ##Pattern 2 (only used when scope1 and scope2 are counted together): \n \
+                Scope 1 and 2 (total): 1,234 unit. \n \
+                ##Requirements: \n \
+                1. Answer with a json object, the keys are the company names exactly as given, the values are the data in the pattern (lines separated by \\n). \n \
+                2. No any explanation needed. \n \
+                3. Pay attention and try hard to find the unit of the data.\n \
+                4. Only use the text of the same company, pay more attention in the latter part of its text. \n \
+                5. If the data is missing or not sure, leave the part as \"N/A\". \n \
+                ---------------------------------- \n \
+                {texts}"
+
+    # ChatGPT supports a strict json schema, other providers only a json object
+    if provider == 'chatgpt':
+        response_format = {
+            'type': "json_schema",
+            'json_schema': {
+                'name': "emissions_data",
+                'strict': True,
+                'schema': {
+                    'type': "object",
+                    'properties': {company_name: {'type': "string"} for company_name in company_names},
+                    'required': company_names,
+                    'additionalProperties': False
+                }
+            }
+        }
+    else:
+        response_format = {'type': "json_object"}
+
+    return {
+        'model': LLM_PROVIDERS[provider]['model'],
+        'messages': [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        'response_format': response_format
+    }
+
+# Get the api key and base url of a LLM provider
+def get_llm_client_config(provider):
+    load_dotenv()
+    config = LLM_PROVIDERS[provider]
+    return os.getenv(config['api_key_env']), os.getenv(config['base_url_env']) or config['base_url']
+
+# Version of the LLM prompts, change it when a prompt changes to invalidate the LLM answer cache
+PROMPT_VERSION = 1
+# Set to True to always call the LLM and ignore cached answers
+LLM_CACHE_BYPASS = False
+
+# Get the LLM answer cache key of a request, built by build_chatgpt_request / build_deepseek_request
+def get_llm_cache_key(provider, request):
+    prompt = "\n".join(message['content'] for message in request['messages'])
+    return cache.llm_cache_key(provider, request['model'], PROMPT_VERSION, prompt)
+
+# Get the LLM answer cache key of one company's answer split out of a batch request (build_batch_request)
+# The batch prompt and answer format differ from the single request, so these answers are kept apart
+# Sample output:
+#       "chatgpt-batch:gpt-4o-mini:1:9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+def get_llm_batch_cache_key(provider, company_name, pdf_text):
+    return cache.llm_cache_key(f"{provider}-batch", LLM_PROVIDERS[provider]['model'], PROMPT_VERSION,
+                               f"{company_name}\n{pdf_text}")
+
+# Estimate the number of tokens of a text (about 4 characters per token)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+# Find the specific emissions data in text using ChatGPT
+# Sample input: 
+#       pdf text
+# Sample output:
+#       Scope 1 (direct): 1,234 t CO2e.
+#       Scope 2 (location-based): 2,345 t CO2e.
+#       Scope 2 (martket-based): 3,456 t CO2e.
+def find_data_in_text_chatgpt(company_name, pdf_text, bypass_cache=False):  
+
+    # Use the cached answer of the same request
+    request = build_chatgpt_request(company_name, pdf_text)
+    cache_key = get_llm_cache_key('chatgpt', request)
+    if not (bypass_cache or LLM_CACHE_BYPASS):
+        answer = cache.load_llm_answer(cache_key)
+        if answer != None:
+            return answer
+
+    api_key, base_url = get_llm_client_config('chatgpt')
+    client = OpenAI(api_key=api_key, base_url=base_url)
+
+    # Call the OpenAI ChatGPT API to analyze the content and find emission data
+    response = client.chat.completions.create(**request)
 
     # Extract the answer text from the response
     answer = response.choices[0].message.content.strip()
+    cache.save_llm_answer(cache_key, answer)
     return answer
 
 # Find the specific emissions data in text using DeepSeek
-def find_data_in_text_deepseek(company_name, pdf_text):
+def find_data_in_text_deepseek(company_name, pdf_text, bypass_cache=False):
     try:
-        load_dotenv()
-        client = OpenAI(
-            api_key=os.getenv('DEEPSEEK_API'), 
-            base_url="https://api.deepseek.com"
-        )
-
-        prompt = f"According to the given text, find the latest scope 1 and scope 2 emissions data of \"{company_name}\",  \
-                    and then give me the data in the one of following patterns.\n \
-                    ##Pattern 1: \n \
-                    Scope 1 (direct): 1,234 unit. \n \
-                    Scope 2 (location-based): 2,345 unit. \n \
-                    Scope 2 (martket-based): 3,456 unit. \n \
-                    ##Pattern 2 (only used when scope1 and scope2 are counted together): \n \
-                    Scope 1 and 2 (total): 1,234 unit. \n \
-                    ##Requirements: \n \
-                    1. No any explanation needed. \n \
-                    2. Pay attention and try hard to find the unit of the data.\n \
-                    3. Pay more attention in the latter part of the content, as they often contain more accurate and detailed data. \n \
-                    4. Pay attention to the calculation method of Scope 2.\n \
-                    5. If the data is missing or not sure, leave the part as \"N/A\". \n \
-                    ---------------------------------- \n \
-                    {pdf_text}."
-        
-        # Call the DeepSeek API with timeout
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "You are a professional analyst who can find scope 1 and scope 2 emissions data from a company's sustainability report."},
-                {"role": "user", "content": prompt},
-            ],
-            stream=False
-        )
+        # Use the cached answer of the same request
+        request = build_deepseek_request(company_name, pdf_text)
+        cache_key = get_llm_cache_key('deepseek', request)
+        if not (bypass_cache or LLM_CACHE_BYPASS):
+            answer = cache.load_llm_answer(cache_key)
+            if answer != None:
+                return answer
+
+        api_key, base_url = get_llm_client_config('deepseek')
+        client = OpenAI(api_key=api_key, base_url=base_url)
+
+        # Call the DeepSeek API
+        response = client.chat.completions.create(**request)
 
         # Extract the answer text from the response
         answer = response.choices[0].message.content.strip()
+        cache.save_llm_answer(cache_key, answer)
         return answer
 
     except Exception as e:
@@ -183,31 +481,251 @@ def data_formatting(text):
     return str(value)
 
 
-# Process one company with specific company name
-def find_emissions_data(company_name, log_file_path, csv_file_path):
+# Minimum confidence of the local extractor to skip the LLM
+FAST_PATH_CONFIDENCE = 0.85
+# Number of companies answered by the local extractor (hits) and sent to the LLM (fallbacks)
+FAST_PATH_STATS = {'hits': 0, 'fallbacks': 0}
+
+# Patterns of the local extractor
+YEAR_PATTERN = re.compile(r"\b(?:fy\s?)?(20[1-3]\d)\b", re.I)
+NUMBER_PATTERN = re.compile(r"(?<![\w.,])(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)(?![\d%])")
+UNIT_PATTERN = re.compile(
+    r"(?:(?:thousand|million|billion)\s+)?(?:(?:metric|short|long)\s+)?"
+    r"(?:tonnes|tonne|tons|ton|kilograms|kg|kt|mmt|mt|t)\s*(?:of\s+)?co\s?2\s*-?\s*e(?:q)?"
+    r"|(?:thousand|million|billion)\s+(?:metric\s+)?(?:tonnes|tons)"
+    r"|metric\s+(?:tonnes|tons)", re.I)
+# Rows of emissions per unit (intensity) instead of absolute emissions
+INTENSITY_PATTERN = re.compile(r"intensity|\bper\b|revenue|/\s*(?:\$|usd|eur|€|£|employee|fte|m\b)", re.I)
+# Words labelling a header year as a target instead of reported data, before ("Target 2030") or after ("2030 goal")
+TARGET_BEFORE_PATTERN = re.compile(r"(?:target|goal|ambition)s?\s*(?:for\s+|by\s+)?[(:]?\s*$", re.I)
+TARGET_AFTER_PATTERN = re.compile(r"^\s*[)]?\s*(?:target|goal|ambition)", re.I)
+SCOPE_ROW_PATTERNS = {
+    'scope1_and_2': re.compile(r"scope\s*1\s*(?:and|&|\+|,)\s*(?:scope\s*)?2", re.I),
+    'scope1': re.compile(r"scope\s*1\b", re.I),
+    'scope2_location': re.compile(r"scope\s*2\b.*location", re.I),
+    'scope2_market': re.compile(r"scope\s*2\b.*market", re.I),
+}
+
+
+# Words allowed in a table row besides its label, numbers and unit (e.g. "direct", "emissions")
+# Rows with more words, or with years, are sentences rather than table rows
+TABLE_ROW_MAX_WORDS = 6
+# Confidence of a value without table evidence, always below FAST_PATH_CONFIDENCE
+LOW_CONFIDENCE = 0.3
+
+
+# Get the years of a header line, with the target years (after this year, or labelled target / goal) marked
+# Sample input:
+#       "GHG emissions (tCO2e) 2022 2023 2030 target"
+# Sample output:
+#       [(2022, False), (2023, False), (2030, True)]
+def get_header_years(header):
+    current_year = datetime.date.today().year
+    years = []
+    for match in YEAR_PATTERN.finditer(header):
+        year = int(match.group(1))
+        target = year > current_year or bool(TARGET_BEFORE_PATTERN.search(header[:match.start()])) or \
+            bool(TARGET_AFTER_PATTERN.search(header[match.end():]))
+        years.append((year, target))
+    return years
+
+
+# Find the latest value in a table row, using the year columns of the nearest header line above
+# The value is only certain with table evidence: a header line with years, and one number per year column
+# Target columns are never the latest value
+# Sample output:
+#       ("12,345", 1.0) if the column is certain
+#       ("12,345", 0.3) if the line is a sentence, a table of contents entry, or has no matching header
+#       (None, 0) if the row has no value
+def find_row_value(lines, row_index, label_end):
+    row = lines[row_index][label_end:]
+    numbers = [number for number in NUMBER_PATTERN.findall(row) if not YEAR_PATTERN.fullmatch(number)]
+    if not numbers:
+        return None, 0
 
-    # Find the pdf file path with the company name
-    files_path = glob.glob(os.path.join("./reports", f"*{company_name}*"))
-    file_path = files_path[0] if files_path else None
+    # Sentences mention years and have many words, table rows only have numbers and a few words
+    words = re.findall(r"[a-z]{2,}", UNIT_PATTERN.sub(" ", row.lower()))
+    if YEAR_PATTERN.search(row) or len(words) > TABLE_ROW_MAX_WORDS:
+        return numbers[0], LOW_CONFIDENCE
+
+    # The header line tells which column is the latest year
+    for header in reversed(lines[max(0, row_index - 15):row_index]):
+        years = get_header_years(header)
+        if len(years) >= 2 and not SCOPE_ROW_PATTERNS['scope1'].search(header):
+            reported = [(year, column) for column, (year, target) in enumerate(years) if not target]
+            if len(years) == len(numbers) and reported:
+                return numbers[max(reported)[1]], 1.0
+            break
+    return numbers[0], LOW_CONFIDENCE
+
+
+# Find the unit of a table row in the row itself
+def find_row_unit(lines, row_index):
+    unit = UNIT_PATTERN.search(lines[row_index])
+    return unit.group(0) if unit else None
+
+
+# Find scope 1 and scope 2 data in text with rules, without the LLM
+# The answer uses the same patterns as the LLM answer, so data_formatting converts the units
+# Sample output:
+#       ("Scope 1 (direct): 12,345 tCO2e.\nScope 2 (location-based): 2,000 tCO2e.\nScope 2 (market-based): N/A.", 0.9)
+def find_data_in_text_local(pdf_text):
+    lines = pdf_text.split("\n")
+    values = {}
+    for name, pattern in SCOPE_ROW_PATTERNS.items():
+        candidates = []
+        for row_index, line in enumerate(lines):
+            match = pattern.search(line)
+            # "Scope 1" rows must not be "Scope 1 and 2" rows, intensity rows are not emissions
+            if not match or (name == 'scope1' and SCOPE_ROW_PATTERNS['scope1_and_2'].search(line)):
+                continue
+            if INTENSITY_PATTERN.search(line):
+                continue
+            value, confidence = find_row_value(lines, row_index, match.end())
+            if value:
+                candidates.append((value, confidence, find_row_unit(lines, row_index)))
+        if candidates:
+            value, confidence, unit = candidates[0]
+            # Different values in several rows, e.g. a table and a summary of another year, are left to the LLM
+            if len({candidate[0] for candidate in candidates}) > 1:
+                confidence = min(confidence, LOW_CONFIDENCE)
+            values[name] = (value, confidence, unit)
+
+    def row_text(name):
+        if name not in values:
+            return "N/A"
+        value, _, unit = values[name]
+        return f"{value} {unit}" if unit else value
+
+    def row_confidence(name):
+        if name not in values:
+            return 0
+        # Values without a unit on their row are left to the LLM
+        value, confidence, unit = values[name]
+        return confidence if unit else min(confidence, LOW_CONFIDENCE)
+
+    if 'scope1' in values:
+        answer = f"Scope 1 (direct): {row_text('scope1')}.\n" \
+                 f"Scope 2 (location-based): {row_text('scope2_location')}.\n" \
+                 f"Scope 2 (market-based): {row_text('scope2_market')}."
+        scope2_confidence = max(row_confidence('scope2_location'), row_confidence('scope2_market'))
+        return answer, 0.5 * row_confidence('scope1') + 0.5 * scope2_confidence
+    if 'scope1_and_2' in values:
+        return f"Scope 1 and 2 (total): {row_text('scope1_and_2')}.", row_confidence('scope1_and_2')
+    return None, 0
+
+
+# Use the local extractor when it is confident enough, otherwise return None to fall back to the LLM
+def find_data_in_text_fast_path(pdf_text, threshold=FAST_PATH_CONFIDENCE):
+    answer, confidence = find_data_in_text_local(pdf_text)
+    if confidence >= threshold:
+        FAST_PATH_STATS['hits'] += 1
+        return answer
+    FAST_PATH_STATS['fallbacks'] += 1
+    return None
+
+
+# Print how many LLM calls were avoided by the local extractor
+def print_fast_path_stats():
+    total = FAST_PATH_STATS['hits'] + FAST_PATH_STATS['fallbacks']
+    hit_rate = FAST_PATH_STATS['hits'] / total * 100 if total else 0
+    print(f"Fast path: {FAST_PATH_STATS['hits']}/{total} companies answered without LLM ({hit_rate:.1f}%)")
+
+
+# Find the pdf file path with the company name
+def find_report_path(company_name):
+    files_path = glob.glob(os.path.join("./reports", f"*{company_name}*.pdf")) # Skip unfinished ".pdf.part" downloads
+    return files_path[0] if files_path else None
+
+
+# Raised inside a worker process when one pdf takes longer than the timeout
+# (BaseException so the error handling inside scan_report does not swallow it)
+class PdfTimeoutError(BaseException):
+    pass
+
+def _raise_pdf_timeout(signum, frame):
+    raise PdfTimeoutError()
+
+
+# Find and scan the report of one company (also used as the worker of the process pool)
+# Sample output:
+#       (True, "scope page text")
+#       None if the pdf is missing, can not be read or timed out
+def extract_report(company_name, timeout=None):
+    file_path = find_report_path(company_name)
     if file_path == None:
         return None
 
-    # Determine if the pdf is a financial report
-    fiscal_year = is_fiscal_year(file_path)
+    # Interrupt the pdf parsing with an alarm (only available on Unix, in the main thread)
+    use_alarm = timeout and hasattr(signal, 'SIGALRM') and \
+        threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_pdf_timeout)
+        signal.alarm(int(timeout))
+    try:
+        fiscal_year, pdf_text = scan_report(file_path)
+    except PdfTimeoutError:
+        print(f"Timeout processing PDF after {timeout}s: {file_path}")
+        return None
+    finally:
+        if use_alarm:
+            signal.alarm(0)
 
-    # Extract text from pdf
-    pdf_text =extract_text_from_pdf(file_path)
     if pdf_text == None:
         return None
+    return fiscal_year, pdf_text
 
-    with open(log_file_path, 'a', encoding='utf-8') as log_file:
-        log_file.write(f"\n=========={company_name}==========\n")
 
-    # Find emissions data in text using ChatGPT
-    data_in_text = find_data_in_text_chatgpt(company_name, pdf_text)
+# Extract reports of many companies in parallel with a process pool
+# Results are yielded in the same order as company_names, so the LLM step can start
+# with the first company while the rest are still being extracted
+# Sample output:
+#       ("APPLE INC", (True, "scope page text"))
+#       ("NVIDIA CORP", None)
+def iter_extracted_reports(company_names, max_workers=PDF_WORKERS, timeout=PDF_TIMEOUT):
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [executor.submit(extract_report, company_name, timeout) for company_name in company_names]
+        for company_name, future in zip(company_names, futures):
+            try:
+                # The worker enforces the timeout itself, wait a bit longer here as a fallback
+                report = future.result(timeout=timeout * 2 if timeout else None)
+            except FutureTimeoutError:
+                print(f"Timeout waiting for PDF extraction of {company_name}")
+                report = None
+            except Exception as e:
+                print(f"Error extracting PDF of {company_name}: {e}")
+                report = None
+            yield company_name, report
+    finally:
+        # Do not wait for stuck workers
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Process one company with specific company name
+def find_emissions_data(company_name, log_file_path, csv_file_path):
+    return find_emissions_data_in_report(company_name, extract_report(company_name), log_file_path, csv_file_path)
+
+
+# Process one company with the report already extracted by extract_report
+def find_emissions_data_in_report(company_name, report, log_file_path, csv_file_path):
+    if report == None:
+        return None
+    fiscal_year, pdf_text = report
+
+    # Find emissions data in text with rules, or using ChatGPT if not confident
+    data_in_text = find_data_in_text_fast_path(pdf_text) or find_data_in_text_chatgpt(company_name, pdf_text)
+    return record_emissions_data(company_name, fiscal_year, data_in_text, log_file_path, csv_file_path)
+
+
+# Convert the LLM answer of one company to numbers, and write them to the log and csv file
+# Sample output:
+#       (True, "1234", "2345", "3456", "-")
+def record_emissions_data(company_name, fiscal_year, data_in_text, log_file_path, csv_file_path):
     if data_in_text == None:
         return None
     with open(log_file_path, 'a', encoding='utf-8') as log_file:
+        log_file.write(f"\n=========={company_name}==========\n")
         log_file.write(f"【data in sentance】\n{data_in_text}\n")
 
     # If the calculation method is "Scope 1 and 2 (total)"
@@ -252,6 +770,9 @@ if __name__ == "__main__":
 
     reports_dir = "./reports/"
     pdf_files = [f for f in os.listdir(reports_dir) if f.endswith('.pdf')]
-    for pdf_file in pdf_files:
-        company_name = os.path.splitext(pdf_file)[0]
-        emissions_data = find_emissions_data(company_name, log_file_path, csv_file_path)
\ No newline at end of file
+    company_names = [os.path.splitext(pdf_file)[0] for pdf_file in pdf_files]
+
+    # Extract pdf text in parallel, then find emissions data in order
+    for company_name, report in iter_extracted_reports(company_names):
+        emissions_data = find_emissions_data_in_report(company_name, report, log_file_path, csv_file_path)
+    print_fast_path_stats()
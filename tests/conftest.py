@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules are imported from the repository root, and database.py needs a port even when no database is used
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DB_PORT', '3306')
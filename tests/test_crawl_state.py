@@ -0,0 +1,100 @@
+import pytest
+
+import crawl_state
+
+
+# Each test uses its own crawl state file
+@pytest.fixture(autouse=True)
+def state_path(monkeypatch, tmp_path):
+    monkeypatch.setattr(crawl_state, 'CRAWL_STATE_PATH', str(tmp_path / "crawl_state.sqlite"))
+
+
+def get_queue_status(company_name):
+    return crawl_state.execute("SELECT status, attempts FROM work_queue WHERE company_name = ?",
+                               (company_name,), fetch=True)[0]
+
+
+# A company without PDF is queued again only while a candidate or query can be retried
+def test_complete_company_fails_when_nothing_to_retry():
+    crawl_state.enqueue_companies(["APPLE INC", "NVIDIA CORP"])
+    crawl_state.claim_companies("worker", 2)
+    crawl_state.record_query("APPLE INC", "apple pdf", ["https://a.com/1.pdf", "https://a.com/2.pdf"])
+    crawl_state.record_candidate("APPLE INC", "https://a.com/1.pdf", 'invalid')
+    crawl_state.record_candidate("APPLE INC", "https://a.com/2.pdf", 'error')
+    crawl_state.record_query("NVIDIA CORP", "nvidia pdf", ["https://n.com/1.pdf"])
+    crawl_state.record_candidate("NVIDIA CORP", "https://n.com/1.pdf", 'invalid')
+
+    assert crawl_state.complete_company("APPLE INC", False) == False
+    assert get_queue_status("APPLE INC") == ('queued', 1)
+    assert crawl_state.complete_company("NVIDIA CORP", False) == True
+    assert get_queue_status("NVIDIA CORP") == ('failed', 1)
+
+
+# Candidates with a final outcome, or tried CANDIDATE_MAX_TRIES times, are filtered out, the order is kept
+def test_filter_pending_urls():
+    urls = ["https://a.com/1.pdf", "https://a.com/2.pdf", "https://a.com/3.pdf", "https://a.com/4.pdf"]
+    crawl_state.record_query("APPLE INC", "apple pdf", urls)
+    crawl_state.record_candidate("APPLE INC", urls[0], 'invalid')
+    for _ in range(crawl_state.CANDIDATE_MAX_TRIES):
+        crawl_state.record_candidate("APPLE INC", urls[1], 'error')
+    crawl_state.record_candidate("APPLE INC", urls[2], 'error')
+    assert crawl_state.filter_pending_urls("APPLE INC", urls[::-1]) == [urls[3], urls[2]]
+    # Other companies have their own candidates
+    assert crawl_state.filter_pending_urls("NVIDIA CORP", urls) == urls
+    assert crawl_state.is_query_done("APPLE INC", "apple pdf") == False
+
+    crawl_state.record_candidate("APPLE INC", urls[2], 'valid')
+    crawl_state.record_candidate("APPLE INC", urls[3], 'rejected')
+    assert crawl_state.is_query_done("APPLE INC", "apple pdf") == True
+
+
+# Negative URL verdicts and search results are only trusted for their TTL
+def test_url_verdict_and_search_ttl(monkeypatch):
+    crawl_state.save_url_verdict("https://a.com/1.pdf", 'invalid', 'hash1')
+    crawl_state.save_url_verdict("https://a.com/2.pdf", 'valid', 'hash2', './reports/APPLE INC.pdf', '"etag"')
+    crawl_state.save_search_results("Apple  INC report", [("https://a.com/1.pdf", "Report")])
+    assert crawl_state.load_url_verdict("https://a.com/1.pdf")['verdict'] == 'invalid'
+    assert crawl_state.load_search_results("apple inc REPORT") == [("https://a.com/1.pdf", "Report")]
+    assert crawl_state.load_url_verdict("https://a.com/3.pdf") == None
+
+    now = crawl_state.time.time()
+    monkeypatch.setattr(crawl_state.time, 'time', lambda: now + 31 * 86400)
+    assert crawl_state.load_url_verdict("https://a.com/1.pdf") == None
+    assert crawl_state.load_url_verdict("https://a.com/2.pdf")['etag'] == '"etag"'
+    assert crawl_state.load_search_results("apple inc report") == None
+
+
+# Each company is claimed by one worker, never attempted companies first, and claimed again once its lease expired
+def test_claim_companies_and_lease(monkeypatch):
+    crawl_state.enqueue_companies(["A", "B", "C"])
+    crawl_state.execute("UPDATE work_queue SET attempts = 1 WHERE company_name = 'A'")
+    first = crawl_state.claim_companies("worker-1", 2)
+    second = crawl_state.claim_companies("worker-2", 2)
+    assert sorted(first) == ["B", "C"]
+    assert second == ["A"]
+    assert crawl_state.claim_companies("worker-3", 2) == []
+
+    # worker-1 died, its companies are claimed again after QUEUE_LEASE
+    crawl_state.complete_company("A", True)
+    now = crawl_state.time.time()
+    monkeypatch.setattr(crawl_state.time, 'time', lambda: now + crawl_state.QUEUE_LEASE + 1)
+    assert sorted(crawl_state.claim_companies("worker-3", 5)) == ["B", "C"]
+    assert get_queue_status("A") == ('done', 1)
+
+
+# Queued companies wait for QUEUE_RETRY_DELAY, done companies are queued again, failed ones only with retry_failed
+def test_queue_retry_delay_and_enqueue(monkeypatch):
+    crawl_state.enqueue_companies(["A", "B"])
+    crawl_state.claim_companies("worker", 2)
+    crawl_state.complete_company("A", False) # no query yet, so it can be retried
+    crawl_state.complete_company("B", True)
+    assert crawl_state.claim_companies("worker", 2) == []
+    assert 0 < crawl_state.get_queue_wait() <= crawl_state.QUEUE_RETRY_DELAY
+
+    crawl_state.enqueue_companies(["B"])
+    assert get_queue_status("B") == ('queued', 0)
+    crawl_state.execute("UPDATE work_queue SET status = 'failed' WHERE company_name = 'A'")
+    crawl_state.enqueue_companies(["A"])
+    assert get_queue_status("A") == ('failed', 1)
+    crawl_state.enqueue_companies(["A"], retry_failed=True)
+    assert get_queue_status("A") == ('queued', 0)
@@ -0,0 +1,95 @@
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import crawler
+from crawler import fetch_links_http
+
+BING_PAGE = b"""<html><body>
+<ol id="b_results">
+  <li class="b_algo"><h2><a href="https://www.apple.com/environment/report.pdf">Environmental <b>Progress</b> Report</a></h2>
+    <div class="b_caption"><a href="https://www.apple.com/cached">Cached</a></div></li>
+  <li class="b_algo"><h2><a href="https://www.acer.com/esg.pdf">Acer ESG</a></h2></li>
+  <li class="b_ad"><h2><a href="https://ads.example.com/">Ad</a></h2></li>
+</ol>
+<a href="/search?q=next">Next</a>
+</body></html>"""
+
+COMPANY_PAGE = b"""<html><head><base href="/reports/2024/"></head><body>
+<a href="esg.pdf">ESG Report</a>
+<a href="/about">About</a>
+<a href="https://cdn.example.com/a.pdf">CDN</a>
+<a href="mailto:esg@example.com">Mail</a>
+</body></html>"""
+
+# Static pages of the fixture server: path: (content type, body)
+PAGES = {
+    '/search': ("text/html; charset=utf-8", BING_PAGE),
+    '/company': ("text/html", COMPANY_PAGE),
+    '/relative': ("text/html", b'<a href="docs/report.pdf">Report</a><a href="../up.pdf">Up</a>'),
+    '/report.pdf': ("application/pdf", b"%PDF-1.4 " + b"<a href='/x'>x</a>" * 10),
+}
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path not in PAGES:
+            self.send_error(404)
+            return
+        content_type, body = PAGES[path]
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    server = HTTPServer(('127.0.0.1', 0), PageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+# Only the links of .b_algo h2 are Bing results, with the text of all their tags
+def test_fetch_links_http_reads_bing_results(base_url):
+    assert fetch_links_http(f"{base_url}/search?q=apple", results_only=True) == [
+        ("https://www.apple.com/environment/report.pdf", "Environmental Progress Report"),
+        ("https://www.acer.com/esg.pdf", "Acer ESG"),
+    ]
+    links = fetch_links_http(f"{base_url}/search?q=apple")
+    assert ("https://www.apple.com/cached", "Cached") in links
+    assert (f"{base_url}/search?q=next", "Next") in links
+
+
+# Relative links are resolved against the page URL, or against <base> when the page has one
+def test_fetch_links_http_resolves_relative_links(base_url):
+    assert fetch_links_http(f"{base_url}/relative") == [
+        (f"{base_url}/docs/report.pdf", "Report"),
+        (f"{base_url}/up.pdf", "Up"),
+    ]
+    assert fetch_links_http(f"{base_url}/company") == [
+        (f"{base_url}/reports/2024/esg.pdf", "ESG Report"),
+        (f"{base_url}/about", "About"),
+        ("https://cdn.example.com/a.pdf", "CDN"),
+    ]
+
+
+# Pages that are not HTML, or not found, return None so the caller falls back to the browser
+def test_fetch_links_http_returns_none_for_non_html(base_url):
+    assert fetch_links_http(f"{base_url}/report.pdf") == None
+    assert fetch_links_http(f"{base_url}/missing") == None
+
+
+# Only the first MAX_PAGE_SIZE bytes of a page are read
+def test_fetch_links_http_caps_page_size(base_url, monkeypatch):
+    monkeypatch.setattr(crawler, 'MAX_PAGE_SIZE', len(b'<a href="docs/report.pdf">Report</a>'))
+    assert fetch_links_http(f"{base_url}/relative") == [(f"{base_url}/docs/report.pdf", "Report")]
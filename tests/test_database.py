@@ -0,0 +1,149 @@
+import os
+import csv
+
+import database
+
+
+# After a failed flush the rows are written one by one, so a failing row does not hold back the others
+# Rows that still fail are tried once more on close, and returned by close
+def test_buffered_writer_skips_failing_rows(monkeypatch):
+    written = []
+    calls = []
+    def bulk_upsert(table_name, columns, rows, update_columns=None, show_progress=True):
+        calls.append(list(rows))
+        if ("BAD",) in rows:
+            raise ValueError("stub error")
+        written.extend(rows)
+    monkeypatch.setattr(database, 'bulk_upsert', bulk_upsert)
+
+    writer = database.BufferedWriter("emissions_data", ["company_name"], batch_size=2, flush_interval=60)
+    for name in ["A", "BAD", "C", "D", "E"]:
+        writer.add((name,))
+    failed_rows = writer.close()
+    assert written == [("A",), ("C",), ("D",), ("E",)]
+    assert failed_rows == [("BAD",)]
+    assert calls == [[("A",), ("BAD",)], [("A",)], [("BAD",)], [("C",), ("D",)],
+                     [("BAD",), ("E",)], [("BAD",)], [("E",)]]
+
+
+def test_buffered_writer_flushes_in_batches(monkeypatch):
+    batches = []
+    monkeypatch.setattr(database, 'bulk_upsert',
+                        lambda table_name, columns, rows, update_columns=None, show_progress=True: batches.append(list(rows)))
+
+    writer = database.BufferedWriter("emissions_data", ["company_name"], batch_size=2, flush_interval=60)
+    for name in ["A", "B", "C"]:
+        writer.add((name,))
+    assert writer.close() == []
+    assert batches == [[("A",), ("B",)], [("C",)]]
+    assert writer.commits == 2
+
+
+# Stand-in for a pooled connection and its cursor, rows are kept in a dict by unique key like
+# INSERT ... ON DUPLICATE KEY UPDATE: a new key inserts the row, an existing key updates the update columns
+class StubConnection:
+    def __init__(self, columns, key_column, update_columns=None, fail_on_chunk=None):
+        self.columns = columns
+        self.key_index = columns.index(key_column)
+        self.update_indexes = [columns.index(column) for column in (update_columns or columns)]
+        self.fail_on_chunk = fail_on_chunk
+        self.table = {}
+        self.pending = {}
+        self.queries = []
+        self.chunks = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def executemany(self, query, rows):
+        self.queries.append(query)
+        self.chunks.append(list(rows))
+        if len(self.chunks) == self.fail_on_chunk:
+            raise database.mysql.connector.Error("stub error")
+        for row in rows:
+            key = row[self.key_index]
+            stored = self.pending.get(key) or self.table.get(key)
+            if stored == None:
+                self.pending[key] = tuple(row)
+            else:
+                updated = list(stored)
+                for index in self.update_indexes:
+                    updated[index] = row[index]
+                self.pending[key] = tuple(updated)
+
+    def commit(self):
+        self.table.update(self.pending)
+        self.pending = {}
+        self.commits += 1
+
+    def rollback(self):
+        self.pending = {}
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def use_stub_connection(monkeypatch, connection):
+    monkeypatch.setattr(database, 'get_connection', lambda: connection)
+    return connection
+
+
+# One multi-row statement and one commit per chunk, the last chunk may be short
+def test_bulk_upsert_commits_each_chunk(monkeypatch):
+    columns = ["company_name", "isin", "weight"]
+    connection = use_stub_connection(monkeypatch, StubConnection(columns, "isin"))
+    rows = [(f"COMPANY {i}", f"ISIN{i}", "1.0") for i in range(5)]
+    database.bulk_upsert("emissions_data", columns, rows, ["weight"], chunk_size=2, show_progress=False)
+
+    assert [len(chunk) for chunk in connection.chunks] == [2, 2, 1]
+    assert [row for chunk in connection.chunks for row in chunk] == rows
+    assert connection.commits == 3
+    assert "ON DUPLICATE KEY UPDATE weight = VALUES(weight)" in connection.queries[0]
+    assert connection.closed
+
+
+# A failed chunk is rolled back and raised, the chunks before it stay committed
+def test_bulk_upsert_rolls_back_failed_chunk(monkeypatch):
+    columns = ["company_name", "isin"]
+    connection = use_stub_connection(monkeypatch, StubConnection(columns, "isin", fail_on_chunk=2))
+    rows = [(f"COMPANY {i}", f"ISIN{i}") for i in range(5)]
+    try:
+        database.bulk_upsert("emissions_data", columns, rows, chunk_size=2, show_progress=False)
+        assert False, "the chunk error is raised"
+    except database.mysql.connector.Error:
+        pass
+    assert connection.commits == 1
+    assert connection.rollbacks == 1
+    assert sorted(connection.table) == ["ISIN0", "ISIN1"]
+    assert connection.closed
+
+
+# data/data.csv has 7 company names listed twice (different share classes, so different isin):
+# the tables are keyed on isin, so both rows are kept, and a row with an isin already loaded updates it,
+# the last row of the same isin wins, even across chunk boundaries
+def test_bulk_upsert_duplicates(monkeypatch):
+    columns = ["company_name", "ticker", "isin", "weight", "sector", "area", "country_region"]
+    with open(os.path.join(os.path.dirname(__file__), "..", "data", "data.csv"), "r", encoding="utf-8") as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader)
+        rows = [tuple(row[:7]) for row in reader]
+    connection = use_stub_connection(monkeypatch, StubConnection(columns, "isin"))
+    database.bulk_upsert("emissions_data", columns, rows, chunk_size=1000, show_progress=False)
+
+    assert len(connection.chunks) == 3
+    assert len(connection.table) == len(rows)
+    names = [row[0] for row in connection.table.values()]
+    assert len(names) - len(set(names)) == 7
+    assert names.count("IBERDROLA SA") == 2
+
+    # Loading again is idempotent, and a changed row of the same isin replaces the stored one
+    apple = next(row for row in rows if row[0] == "APPLE INC")
+    changed = apple[:3] + ("9.99",) + apple[4:]
+    database.bulk_upsert("emissions_data", columns, rows[:999] + [changed, apple[:3] + ("5.55",) + apple[4:]],
+                         chunk_size=1000, show_progress=False)
+    assert len(connection.table) == len(rows)
+    assert connection.table[apple[2]][3] == "5.55"
@@ -0,0 +1,92 @@
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+
+import openai
+
+import cache
+import llm_pipeline
+from llm_pipeline import AsyncLLMExtractor, TokenBucket
+
+PDF_TEXT = "GHG emissions\nScope 1 emissions were 12,345 tCO2e.\nScope 2 emissions were 2,000 tCO2e."
+ANSWER = "Scope 1 (direct): 12,345 tCO2e.\nScope 2 (location-based): 2,000 tCO2e."
+
+
+# Stand-in for AsyncOpenAI: returns the given answers in order, an exception in the list is raised instead
+class FakeClient:
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **request):
+        self.requests.append(request)
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+    async def close(self):
+        pass
+
+
+def make_extractor(answers, **kwargs):
+    extractor = AsyncLLMExtractor('chatgpt', api_key='test', **kwargs)
+    extractor.client = FakeClient(answers)
+    return extractor
+
+def api_error(error_class, status_code):
+    response = SimpleNamespace(status_code=status_code, headers={}, request=None)
+    return error_class(f"status {status_code}", response=response, body=None)
+
+
+# Once the bucket is empty, the next caller waits for the refill
+def test_token_bucket_waits_when_empty():
+    async def run():
+        bucket = TokenBucket(per_minute=600) # 10 per second
+        start = time.monotonic()
+        await bucket.acquire(600)
+        assert time.monotonic() - start < 0.1
+        await bucket.acquire(3)
+        return time.monotonic() - start
+    assert asyncio.run(run()) >= 0.25
+
+
+# 429 and 5xx errors are retried after a backoff
+def test_send_request_retries_retryable_errors(monkeypatch):
+    monkeypatch.setattr(llm_pipeline, 'LLM_BACKOFF_BASE', 0.01)
+    extractor = make_extractor([api_error(openai.RateLimitError, 429),
+                                api_error(openai.InternalServerError, 500), ANSWER])
+    request = extractor.build_request("APPLE INC", PDF_TEXT)
+    assert asyncio.run(extractor.send_request(request, "APPLE INC")) == ANSWER
+    assert len(extractor.client.requests) == 3
+
+
+# Other errors fail at once
+def test_send_request_does_not_retry_client_errors(monkeypatch):
+    monkeypatch.setattr(llm_pipeline, 'LLM_BACKOFF_BASE', 0.01)
+    extractor = make_extractor([api_error(openai.BadRequestError, 400), ANSWER])
+    request = extractor.build_request("APPLE INC", PDF_TEXT)
+    assert asyncio.run(extractor.send_request(request, "APPLE INC")) == None
+    assert len(extractor.client.requests) == 1
+
+
+# The second lookup of the same text is answered from the cache without a request
+def test_find_data_in_text_uses_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, 'LLM_CACHE_PATH', str(tmp_path / "llm_answers.sqlite"))
+    extractor = make_extractor([ANSWER])
+    assert asyncio.run(extractor.find_data_in_text("APPLE INC", PDF_TEXT)) == ANSWER
+    assert asyncio.run(extractor.find_data_in_text("APPLE INC", PDF_TEXT)) == ANSWER
+    assert len(extractor.client.requests) == 1
+
+
+# Answers split out of a batch are cached for batches only, a single request still asks the LLM
+def test_batch_answers_are_not_single_request_hits(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, 'LLM_CACHE_PATH', str(tmp_path / "llm_answers.sqlite"))
+    extractor = make_extractor([json.dumps({"APPLE INC": ANSWER}), ANSWER])
+    assert asyncio.run(extractor.find_data_in_batch([("APPLE INC", PDF_TEXT)])) == {"APPLE INC": ANSWER}
+    assert asyncio.run(extractor.load_cached_answer("APPLE INC", PDF_TEXT, batch=True)) == ANSWER
+    assert asyncio.run(extractor.load_cached_answer("APPLE INC", PDF_TEXT)) == None
+    assert asyncio.run(extractor.find_data_in_text("APPLE INC", PDF_TEXT)) == ANSWER
+    assert len(extractor.client.requests) == 2
@@ -0,0 +1,161 @@
+from types import SimpleNamespace
+
+import pytest
+
+import cache
+import process_pdf
+from process_pdf import find_data_in_text_local, find_data_in_text_fast_path, FAST_PATH_CONFIDENCE, \
+    select_relevant_text, estimate_tokens, has_scope_page, scan_report
+
+
+# A standard GHG table: header with years, one number per year column, unit on each row
+def test_fast_path_reads_table():
+    text = "\n".join([
+        "GHG emissions",
+        "Metric 2023 2022 2021",
+        "Scope 1 (direct) emissions tCO2e 12,345 13,000 14,100",
+        "Scope 2 location-based emissions tCO2e 2,000 2,100 2,300",
+        "Scope 2 market-based emissions tCO2e 1,500 1,600 1,900",
+    ])
+    answer, confidence = find_data_in_text_local(text)
+    assert confidence >= FAST_PATH_CONFIDENCE
+    assert answer == "Scope 1 (direct): 12,345 tCO2e.\n" \
+                     "Scope 2 (location-based): 2,000 tCO2e.\n" \
+                     "Scope 2 (market-based): 1,500 tCO2e."
+
+
+# The latest year is not always the first column
+def test_fast_path_uses_latest_year_column():
+    text = "\n".join([
+        "Metric 2021 2022 2023",
+        "Scope 1 tCO2e 14,100 13,000 12,345",
+        "Scope 2 (market-based) tCO2e 1,900 1,600 1,500",
+    ])
+    answer, confidence = find_data_in_text_local(text)
+    assert confidence >= FAST_PATH_CONFIDENCE
+    assert "Scope 1 (direct): 12,345 tCO2e." in answer
+    assert "Scope 2 (market-based): 1,500 tCO2e." in answer
+
+
+# Numbers in sentences are left to the LLM
+def test_fast_path_rejects_prose():
+    text = "\n".join([
+        "In 2023 and 2022 we continued our climate programme.",
+        "Our Scope 1 emissions fell by 1,200 tCO2e compared with 2019, thanks to fleet electrification.",
+        "Scope 2 market-based emissions were 3,400 tCO2e in 2023 after new renewable contracts.",
+    ])
+    _, confidence = find_data_in_text_local(text)
+    assert confidence < FAST_PATH_CONFIDENCE
+    assert find_data_in_text_fast_path(text) == None
+
+
+# Page numbers of a table of contents are not values
+def test_fast_path_rejects_table_of_contents():
+    text = "\n".join([
+        "Contents",
+        "Climate strategy .......... 12",
+        "Emissions in tCO2e .......... 44",
+        "Scope 1 and 2 emissions .......... 45",
+        "Scope 1 emissions .......... 46",
+        "Scope 2 emissions (location-based) .......... 47",
+        "Scope 2 emissions (market-based) .......... 48",
+    ])
+    _, confidence = find_data_in_text_local(text)
+    assert confidence < FAST_PATH_CONFIDENCE
+    assert find_data_in_text_fast_path(text) == None
+
+
+# Without a unit on the row, the value may be in any unit
+def test_fast_path_needs_unit_on_row():
+    text = "\n".join([
+        "All figures in tCO2e",
+        "Metric 2023 2022",
+        "Scope 1 12,345 13,000",
+        "Scope 2 (market-based) 1,500 1,600",
+    ])
+    _, confidence = find_data_in_text_local(text)
+    assert confidence < FAST_PATH_CONFIDENCE
+
+
+# A single window over the budget is cut to fit instead of dropped
+def test_select_relevant_text_truncates_oversized_window():
+    text = "Scope 1 emissions tCO2e " + "12,345 " * 2000
+    selected = select_relevant_text(text, token_budget=100)
+    assert selected.startswith("Scope 1 emissions tCO2e 12,345")
+    assert estimate_tokens(selected) <= 100
+
+
+# Target columns are not reported data, the latest reported year is used
+def test_fast_path_skips_target_column():
+    text = "\n".join([
+        "GHG emissions (tCO2e) 2022 2023 2030 target",
+        "Scope 1 emissions tCO2e 14,000 12,345 7,000",
+        "Scope 2 market-based emissions tCO2e 1,600 1,500 800",
+    ])
+    answer, _ = find_data_in_text_local(text)
+    assert "Scope 1 (direct): 12,345 tCO2e." in answer
+    assert "Scope 2 (market-based): 1,500 tCO2e." in answer
+
+
+# Rows of emissions per unit of revenue are not emissions, and conflicting rows are left to the LLM
+def test_fast_path_skips_intensity_and_conflicts():
+    table = [
+        "Metric 2023 2022",
+        "Scope 1 intensity tCO2e per $m revenue 4.2 4.5",
+        "Scope 1 emissions tCO2e 12,345 13,000",
+        "Scope 2 market-based emissions tCO2e 1,500 1,600",
+    ]
+    answer, confidence = find_data_in_text_local("\n".join(table))
+    assert confidence >= FAST_PATH_CONFIDENCE
+    assert "Scope 1 (direct): 12,345 tCO2e." in answer
+
+    conflicting = table + ["Summary 2021 2020", "Scope 1 emissions tCO2e 11,000 10,000"]
+    assert find_data_in_text_fast_path("\n".join(conflicting)) == None
+
+
+# Stand-in for PdfReader, counting the pages extracted
+class FakePdfReader:
+    PAGES = ["Introduction", "Scope 1 emissions 2023", "FY2024 Scope 2 emissions 2024", "Appendix"]
+    opened = 0
+    extracted = 0
+
+    def __init__(self, pdf_path):
+        FakePdfReader.opened += 1
+        self.pages = [SimpleNamespace(extract_text=lambda text=text: FakePdfReader.extract(text)) for text in self.PAGES]
+
+    @classmethod
+    def extract(cls, text):
+        cls.extracted += 1
+        return text
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch, tmp_path):
+    monkeypatch.setattr(process_pdf, 'PdfReader', FakePdfReader)
+    monkeypatch.setattr(cache, 'PDF_CACHE_DIR', str(tmp_path / "pdf_text"))
+    FakePdfReader.opened = FakePdfReader.extracted = 0
+    pdf_path = tmp_path / "report.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 fake")
+    return str(pdf_path)
+
+
+# An early-exit scan caches the pages it read, a later full scan only extracts the rest,
+# and computes the matches of the new predicate over the cached pages too
+def test_scan_pdf_extends_early_exit_cache(fake_pdf):
+    assert has_scope_page(fake_pdf) == True
+    assert FakePdfReader.extracted == 2
+
+    assert scan_report(fake_pdf) == (True, "Scope 1 emissions 2023FY2024 Scope 2 emissions 2024")
+    assert FakePdfReader.extracted == 4
+
+    # Everything is cached now, the pdf is not opened again
+    opened = FakePdfReader.opened
+    assert scan_report(fake_pdf) == (True, "Scope 1 emissions 2023FY2024 Scope 2 emissions 2024")
+    assert FakePdfReader.extracted == 4
+    assert FakePdfReader.opened == opened
+
+
+# Validation of downloaded candidates leaves nothing in the cache
+def test_scan_pdf_without_cache(fake_pdf, tmp_path):
+    assert has_scope_page(fake_pdf, use_cache=False) == True
+    assert not (tmp_path / "pdf_text").exists()